@@ -0,0 +1,218 @@
+"""
+Benchmarks for the hovercal prep and viz hot paths.
+
+Builds synthetic Spotify exports and daily frames at increasing scales, times
+spotify_cleaner, spotify_hour_cleaner, listening_totals, df_prepper, single_year_heatmap, year_heatmap, small_multiples
+and the html serialization separately, records the peak memory of each (and the size of the
+frame df_prepper returns), and writes the results to a json file. Pass --baseline
+with an earlier results file to see how a release compares.
+
+Usage:
+    python benchmarks/bench_hovercal.py --preset quick --output bench.json
+    python benchmarks/bench_hovercal.py --preset full --baseline bench_0.1.0.json
+"""
+import pandas as pd
+import numpy as np
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import hovercal
+
+# (number of plays, number of years) for the prep benchmarks, and number of years
+# for the viz benchmarks
+PRESETS = {'quick': {'plays': [10_000, 100_000], 'years': [1, 5]},
+           'full': {'plays': [10_000, 100_000, 1_000_000, 10_000_000], 'years': [1, 5, 10, 20]}}
+
+SHOW_NAME = 'Benchmark Podcast'
+
+def synthetic_export(n_plays, n_years, n_shows=5, n_episodes=200, seed=0):
+    """
+    A frame shaped like the spotify endsong json's, with n_plays records spread over
+    n_years (ending in 2022), n_shows podcasts and n_episodes episodes per podcast.
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64(f'{2023 - n_years}-01-01T00:00:00')
+    seconds = rng.integers(0, n_years * 365 * 24 * 3600, n_plays)
+    ts = np.char.add(np.datetime_as_string(start + seconds.astype('timedelta64[s]'), unit='s'), 'Z')
+
+    shows = np.array([SHOW_NAME] + [f'Podcast {i}' for i in range(1, n_shows)], dtype=object)
+    episodes = np.array([f'{i}: Episode {i}' for i in range(n_episodes)], dtype=object)
+
+    return pd.DataFrame({'ts': ts,
+                         'username': 'benchmark',
+                         'ms_played': rng.integers(0, 3_600_000, n_plays),
+                         'conn_country': 'US',
+                         'episode_name': episodes[rng.integers(0, n_episodes, n_plays)],
+                         'episode_show_name': shows[rng.integers(0, n_shows, n_plays)],
+                         'reason_start': 'trackdone',
+                         'reason_end': 'trackdone'})
+
+def synthetic_daily(n_years, seed=0):
+    """
+    A daily frame like the output of spotify_cleaner, with a value on about half
+    of the days in n_years (ending in 2022).
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(f'1/1/{2023 - n_years}', '12/31/2022')
+    dates = dates[rng.random(len(dates)) < 0.5]
+
+    daily_df = pd.DataFrame({'date': dates,
+                             'value': rng.random(len(dates)) * 100,
+                             'episode_name': [f"{{'Episode {i % 200}'}}" for i in range(len(dates))]})
+
+    return hovercal.df_prepper(daily_df)
+
+def measure(func, repeat=3):
+    """
+    Best wall time over repeat runs, then one more run under tracemalloc for the
+    peak memory allocated by func.
+    Returns
+    -------
+    result : dict
+        With keys seconds and peak_mb.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': min(times), 'peak_mb': peak / 2**20}
+
+def run_benchmarks(preset, repeat=3):
+    """
+    Runs every benchmark in the preset and returns a list of result dicts, each
+    with keys name, scale, seconds and peak_mb.
+    """
+    results = []
+
+    def record(name, scale, func, repeat=repeat):
+        result = {'name': name, 'scale': scale, **measure(func, repeat)}
+        print(f"{name:<22}{scale:<22}{result['seconds']:>10.4f} s{result['peak_mb']:>10.1f} MB", flush=True)
+        results.append(result)
+
+    for n_plays in PRESETS[preset]['plays']:
+        spotify_df = synthetic_export(n_plays, n_years=5)
+        scale = f'{n_plays} plays'
+        record('spotify_cleaner', scale, lambda: hovercal.spotify_cleaner(spotify_df, SHOW_NAME))
+        record('spotify_hour_cleaner', scale, lambda: hovercal.spotify_hour_cleaner(spotify_df, SHOW_NAME))
+        record('listening_totals', scale,
+               lambda: hovercal.listening_totals(spotify_df, by_entity=True))
+        dates_df = pd.DataFrame({'date': pd.to_datetime(spotify_df.ts.str[:10])})
+        # df_prepper leaves dates_df alone unless asked, so no copy is needed between runs
+        record('df_prepper', scale, lambda: hovercal.df_prepper(dates_df))
+        results[-1]['frame_mb'] = hovercal.df_prepper(dates_df).memory_usage(index=False).sum() / 2**20
+        record('df_prepper_inplace', scale, lambda: hovercal.df_prepper(dates_df, inplace=True))
+        del spotify_df, dates_df
+
+    # Load the plotting stack up front, so it is not counted in the first viz benchmark
+    hovercal.viz._load_extension()
+
+    for n_years in PRESETS[preset]['years']:
+        daily_df = synthetic_daily(n_years)
+        year_list = sorted(daily_df.year.unique().tolist())
+        scale = f'{n_years} years'
+        record('single_year_heatmap', scale,
+               lambda: hovercal.single_year_heatmap(daily_df.loc[daily_df.year == year_list[-1]], year_list[-1],
+                                                    hover_columns=['episode_name']))
+        record('year_heatmap', scale,
+               lambda: hovercal.year_heatmap(daily_df, year_list, hover_columns=['episode_name']))
+
+        # Rendered to bokeh, as on every refresh of a dashboard, without and with warm tiles
+        record('year_heatmap_render', scale,
+               lambda: hovercal.year_heatmap(daily_df, year_list, hover_columns=['episode_name']).get_root())
+        tile_cache = hovercal.TileCache(cache_dir=None)
+        record('year_heatmap_tiled', scale,
+               lambda: hovercal.year_heatmap(daily_df, year_list, hover_columns=['episode_name'],
+                                             tile_cache=tile_cache).get_root())
+
+        panel = hovercal.year_heatmap(daily_df, year_list, hover_columns=['episode_name'])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            html_path = os.path.join(tmp_dir, 'calendar.html')
+            # Serialization is slow, so only time it once
+            record('html_serialization', scale, lambda: panel.save(html_path), repeat=1)
+            results[-1]['html_mb'] = os.path.getsize(html_path) / 2**20
+
+    daily_df = synthetic_daily(1)
+    for n_entities in [10, 100]:
+        # The same year repeated for every calendar
+        grid_df = pd.concat([daily_df.assign(show=f'Show {i}') for i in range(n_entities)], ignore_index=True)
+        scale = f'{n_entities} calendars'
+        record('small_multiples', scale, lambda: hovercal.small_multiples(grid_df, 'show', 2022))
+
+        panel = hovercal.small_multiples(grid_df, 'show', 2022)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            html_path = os.path.join(tmp_dir, 'grid.html')
+            record('grid_serialization', scale, lambda: panel.save(html_path), repeat=1)
+            results[-1]['html_mb'] = os.path.getsize(html_path) / 2**20
+
+    return results
+
+def compare(results, baseline):
+    """
+    Prints how the time and peak memory of each result compare to the same name and
+    scale in baseline. Returns the largest slowdown (new time / baseline time).
+    """
+    baseline_results = {(result['name'], result['scale']): result for result in baseline['results']}
+    worst = 0
+    print(f"\n{'':<44}{'baseline s':>12}{'now s':>12}{'ratio':>8}{'baseline MB':>13}{'now MB':>10}")
+    for result in results:
+        key = (result['name'], result['scale'])
+        if key not in baseline_results:
+            continue
+        old = baseline_results[key]
+        ratio = result['seconds'] / old['seconds']
+        worst = max(worst, ratio)
+        print(f"{key[0]:<22}{key[1]:<22}{old['seconds']:>12.4f}{result['seconds']:>12.4f}{ratio:>8.2f}"
+              f"{old['peak_mb']:>13.1f}{result['peak_mb']:>10.1f}")
+
+    return worst
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark, the best is kept')
+    parser.add_argument('--output', default='bench_results.json', help='where to write the json results')
+    parser.add_argument('--baseline', help='earlier json results to compare against')
+    parser.add_argument('--max-slowdown', type=float,
+                        help='exit with an error if any benchmark is this many times slower than the baseline')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.preset, args.repeat)
+    output = {'meta': {'hovercal': hovercal.__version__,
+                       'pandas': pd.__version__,
+                       'numpy': np.__version__,
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'preset': args.preset,
+                       'date': datetime.datetime.now().isoformat(timespec='seconds')},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f'\nWrote {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            worst = compare(results, json.load(f))
+        if args.max_slowdown is not None and worst > args.max_slowdown:
+            sys.exit(f'Slowest benchmark is {worst:.2f}x the baseline')
+
+if __name__ == '__main__':
+    main()
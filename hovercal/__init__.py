@@ -1,8 +1,39 @@
 from .prep import *
-from .viz import *
+from .geometry import *
+from .export import *
+from .colors import color_range, cell_colors
+from .profiling import profile_stages, stage, register_callback, unregister_callback, StageProfile
+
+import importlib
+
+# The plotting modules import holoviews, bokeh and panel (and cache imports pyarrow), which
+# takes seconds and a lot of memory. They are only imported the first time one of their
+# functions is used, so `import hovercal` stays cheap for code that only cleans data.
+_LAZY_ATTRIBUTES = {'joint_colorbar': 'viz',
+                    'single_year_heatmap': 'viz',
+                    'year_heatmap': 'viz',
+                    'hour_heatmap': 'viz',
+                    'small_multiples': 'viz',
+                    'LiveCalendar': 'live',
+                    'CrossFilterCalendar': 'crossfilter',
+                    'TileCache': 'tiles',
+                    'static_year_heatmap': 'static',
+                    'cached_spotify_reader': 'cache'}
+_LAZY_MODULES = ['viz', 'live', 'crossfilter', 'tiles', 'static', 'cache']
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(f'.{_LAZY_ATTRIBUTES[name]}', __name__)
+        return getattr(module, name)
+    if name in _LAZY_MODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
 
 
 __author__ = "Liana Merk"
 __version__ = "0.1.0"
 __license__ = "MIT"
-__email__ = "liana.merk@gmail.com"
\ No newline at end of file
+__email__ = "liana.merk@gmail.com"
@@ -0,0 +1,136 @@
+import pandas as pd
+
+import glob
+import hashlib
+import os
+import threading
+
+from . import __version__
+from .prep import _daily_totals, _merge_partials, _read_spotify_file, _spotify_file_list
+from .profiling import profiled
+
+# Parquet needs pyarrow. Without it the cache falls back to pickles, which work
+# the same but are bigger and slower to load.
+try:
+    import pyarrow
+    CACHE_FORMAT = 'parquet'
+except ImportError:
+    CACHE_FORMAT = 'pickle'
+
+def _file_key(file_name, podcast_name, key, tz=None):
+    """
+    Cache key for one export file, podcast and timezone. With key='mtime' it is based on the path,
+    size and modification time of the file, with key='hash' on the contents of the file. The
+    hovercal and pandas versions are part of it, since either can change the aggregates.
+    """
+    digest = hashlib.sha256()
+    if key == 'hash':
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+    elif key == 'mtime':
+        stat = os.stat(file_name)
+        digest.update(f'{os.path.abspath(file_name)}|{stat.st_size}|{stat.st_mtime_ns}'.encode())
+    else:
+        raise ValueError(f"key must be 'mtime' or 'hash', not {key!r}")
+    digest.update(f'|{podcast_name}|{tz}|{__version__}|{pd.__version__}'.encode())
+
+    return digest.hexdigest()
+
+def _podcast_key(podcast_name, tz=None):
+    """
+    Short key shared by every cache file of a podcast and timezone, so a new merged frame
+    can replace the files it supersedes.
+    """
+    return hashlib.sha256(f'{podcast_name}|{tz}'.encode()).hexdigest()[:16]
+
+def _remove_stale(cache_dir, prefix, keep):
+    """
+    Deletes the cache files whose name starts with prefix, other than the paths in keep.
+    """
+    for stale_path in glob.glob(_cache_path(glob.escape(cache_dir), prefix + '*')):
+        if stale_path not in keep:
+            try:
+                os.remove(stale_path)
+            except FileNotFoundError:
+                # Another process cleaned it up first
+                pass
+
+def _cache_path(cache_dir, name):
+    extension = 'parquet' if CACHE_FORMAT == 'parquet' else 'pkl'
+    return os.path.join(cache_dir, f'{name}.{extension}')
+
+def _load(path):
+    if CACHE_FORMAT == 'parquet':
+        # Memory mapped, so the columns are read straight from the file
+        return pd.read_parquet(path, memory_map=True)
+    return pd.read_pickle(path)
+
+def _save(df, path):
+    # Write next to the final file then move it in, so a crash never leaves half a cache entry.
+    # The name is unique to the process and thread, so concurrent writers don't collide
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    if CACHE_FORMAT == 'parquet':
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+@profiled('cached_spotify_reader')
+def cached_spotify_reader(paths, podcast_name, cache_dir='.hovercal_cache', key='mtime', tz=None):
+    """
+    Same as spotify_reader, but keeps the aggregates on disk so refreshing a dashboard
+    doesn't parse the raw json again. Each export file's per-day partial aggregates are
+    cached under a key made from the file and the podcast name, so when a new endsong
+    file shows up only that file is read and merged in. The merged daily frame is cached
+    too, so a refresh with no new files is a single read. Only the latest merged frame of
+    each podcast and timezone is kept, with the partials of the files it was made from.
+    Parameters
+    ----------
+    paths : String or list of Strings
+        Either a glob pattern (i.e. './data/endsong*.json') or a list of paths to
+        spotify extended listening history json's.
+    podcast_name: String
+        Name of the podcast. Parsed based on the episode_show_name column.
+    cache_dir: String
+        Directory for the cache files, created if needed. Stored as parquet if pyarrow is
+        installed, otherwise as pickles.
+    key: String
+        Either "mtime" or "hash". mtime (the default) trusts the size and modification time
+        of each file, hash reads every file to hash its contents.
+    tz: String or None
+        Timezone the days are counted in, see spotify_cleaner. Each timezone is cached separately.
+    Returns
+    -------
+    day_totes_df : DataFrame
+        Same columns as the output of spotify_cleaner.
+    """
+    file_list = _spotify_file_list(paths)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    file_keys = [_file_key(file_name, podcast_name, key, tz) for file_name in file_list]
+    podcast_key = _podcast_key(podcast_name, tz)
+    partial_paths = [_cache_path(cache_dir, f'partial_{podcast_key}_{file_key}') for file_key in file_keys]
+    # The merged frame depends on every file, in order
+    merged_prefix = f'daily_{podcast_key}_'
+    merged_path = _cache_path(cache_dir, merged_prefix + hashlib.sha256('|'.join(file_keys).encode()).hexdigest())
+    if os.path.exists(merged_path):
+        return _load(merged_path)
+
+    def partials():
+        for file_name, partial_path in zip(file_list, partial_paths):
+            if os.path.exists(partial_path):
+                yield _load(partial_path)
+            else:
+                partial_df = _read_spotify_file(file_name, podcast_name, tz)
+                _save(partial_df, partial_path)
+                yield partial_df
+
+    day_totes_df = _daily_totals(_merge_partials(partials()))
+    _save(day_totes_df, merged_path)
+    # The merged frames of older sets of files, and the partials of files that changed or
+    # are gone, are never read again
+    _remove_stale(cache_dir, merged_prefix, [merged_path])
+    _remove_stale(cache_dir, f'partial_{podcast_key}_', partial_paths)
+
+    return day_totes_df
@@ -0,0 +1,79 @@
+import numpy as np
+
+# Number of colors a colormap is sampled at, same as the bokeh color mappers
+N_COLORS = 256
+
+COLOR_SCALES = ('linear', 'log')
+
+def color_range(values, color_scale='linear', clip_percentiles=None):
+    """
+    Works out the range the colors are spread over, in one pass over every value that
+    will be shown (i.e. all years at once), so every plot and the colorbar agree.
+    Parameters
+    ----------
+    values : array-like
+        Every value that will be colored. NaNs are ignored.
+    color_scale: String
+        Either "linear" or "log". Log scales only look at values above 0.
+    clip_percentiles: tuple of two numbers, or None
+        (low, high) percentiles of values to spread the colors between, i.e. (0, 99) so a
+        single outlier day doesn't wash out every other day. Values outside of the range get
+        the first or last color. If None, the range goes from 1.0 (linear) or the smallest
+        value (log) to the largest value.
+    Returns
+    -------
+    cmap_min, cmap_max : floats
+        The ends of the colormap. (1.0, 1.0) if there are no values.
+    """
+    if color_scale not in COLOR_SCALES:
+        raise ValueError(f"color_scale must be 'linear' or 'log', not {color_scale!r}")
+
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if color_scale == 'log':
+        values = values[values > 0]
+    if len(values) == 0:
+        return 1.0, 1.0
+
+    if clip_percentiles is None:
+        cmap_min = 1.0 if color_scale == 'linear' else values.min()
+        cmap_max = values.max()
+    else:
+        cmap_min, cmap_max = np.percentile(values, clip_percentiles)
+
+    return float(cmap_min), float(max(cmap_max, cmap_min))
+
+def color_indices(values, cmap_min, cmap_max, color_scale='linear', n_colors=N_COLORS):
+    """
+    Maps values onto palette indices the way the bokeh LinearColorMapper (or LogColorMapper)
+    does with low=cmap_min and high=cmap_max. Values outside of the range get the end
+    colors, NaN values get -1.
+    """
+    values = np.asarray(values, dtype=float)
+    empty = np.isnan(values)
+    if color_scale == 'log':
+        # Zero and below can't be placed on a log scale, they get the first color
+        values = np.log(np.where(values > 0, values, cmap_min))
+        cmap_min, cmap_max = np.log(cmap_min), np.log(cmap_max)
+
+    span = max(cmap_max - cmap_min, np.finfo(float).eps)
+    indices = np.clip(np.floor((values - cmap_min) / span * n_colors), 0, n_colors - 1)
+
+    return np.where(empty, -1, indices).astype('int64')
+
+def cell_colors(values, cmap_min, cmap_max, cmap_color='Blues', color_scale='linear', empty_color='#D3D3D3'):
+    """
+    The hex color of every value, the same color bokeh would pick for it, so the browser
+    can fill each cell without mapping colors itself. NaN values get empty_color.
+    Returns
+    -------
+    colors : numpy array
+        Object array of hex strings, same length as values.
+    """
+    # holoviews is only needed here, so the rest of the module stays light
+    from holoviews.plotting.util import process_cmap
+
+    # Index -1 (NaN) picks the empty color off the end
+    palette = np.array(process_cmap(cmap_color, ncolors=N_COLORS) + [empty_color], dtype=object)
+
+    return palette[color_indices(values, cmap_min, cmap_max, color_scale)]
@@ -0,0 +1,153 @@
+import pandas as pd
+import numpy as np
+
+import panel as pn
+
+from .live import LiveCalendar
+from .prep import _parse_times
+from .profiling import profiled, stage
+
+class CrossFilterCalendar:
+    """
+    A calendar with a picker for the shows, artists or episodes (any entity column) it
+    adds up. The value of every entity on every day is worked out once and kept as a
+    sparse entity x day matrix. Picking entities sums their rows of the matrix and swaps
+    the new daily values into a LiveCalendar, so only the heatmap data and the colorbar
+    range change, not the layout.
+    Parameters
+    ----------
+    df : DataFrame
+        One row per record (i.e. a play), with columns date, entity_column and value_column.
+        Several rows for the same entity and day are added up.
+    entity_column: String
+        Column to pick from (i.e. episode_show_name).
+    year_list : list of integers (years), or None
+        Years to show. If None, every year in df.
+    value_column: String
+        Column with the values to add up.
+    selected: list, or None
+        Entities picked to begin with. If None, the one with the largest total.
+    **options :
+        Any of the styling keyword arguments of year_heatmap (fig_height, cmap_color,
+        compact, show_toolbar...). hover_columns are not supported, since the days are
+        made up of many records.
+    """
+    def __init__(self, df, entity_column, year_list=None, value_column='value', selected=None, **options):
+        self.value_column = value_column
+        with stage('crossfilter.matrix'):
+            self._build_matrix(df, entity_column, year_list, value_column)
+
+        if selected is None:
+            totals = np.add.reduceat(self.values, self.indptr[:-1]) if len(self.values) else []
+            selected = [self.entities[np.argmax(totals)]] if len(totals) else []
+
+        self.calendar = LiveCalendar(self.daily_values(selected),
+                                     self.year_list,
+                                     value_column = value_column,
+                                     **options)
+
+        self.picker = pn.widgets.MultiChoice(label = entity_column,
+                                             options = list(self.entities),
+                                             value = list(selected))
+        self.picker.param.watch(lambda event: self.select(event.new), 'value')
+
+        self.layout = pn.Column(self.picker, self.calendar.layout)
+
+    @classmethod
+    def from_spotify(cls, df, entity_column='episode_show_name', year_list=None, tz=None, **options):
+        """
+        Makes a CrossFilterCalendar of minutes played straight from spotify json's.
+        Parameters
+        ----------
+        df : DataFrame
+            Can be directly from spotify json's.
+        entity_column: String
+            Column to pick from, i.e. episode_show_name, episode_name or
+            master_metadata_album_artist_name.
+        tz: String or Series, or None
+            Timezone the days are counted in, see spotify_cleaner.
+        year_list, **options :
+            Same as CrossFilterCalendar.
+        """
+        plays_df = _parse_times(df.loc[df[entity_column].notna(), ['ts', 'ms_played', entity_column]], tz)
+        plays_df['mPlayed'] = plays_df.ms_played / 60000
+
+        return cls(plays_df, entity_column, year_list, value_column='mPlayed', **options)
+
+    def _build_matrix(self, df, entity_column, year_list, value_column):
+        """
+        Adds up df into the sparse entity x day matrix, stored like a CSR matrix: the
+        entries of entity i are indptr[i]:indptr[i + 1] of days (day number, counted from
+        January 1st of the first year) and values.
+        """
+        days = pd.to_datetime(df.date).to_numpy().astype('datetime64[D]')
+        years = days.astype('datetime64[Y]').astype('int64') + 1970
+        if year_list is None:
+            year_list = sorted(np.unique(years).tolist())
+        self.year_list = list(year_list)
+
+        keep = np.isin(years, self.year_list)
+        entities = df[entity_column].to_numpy()[keep].astype(str)
+        days = days[keep]
+
+        self.first_day = np.datetime64(f'{min(self.year_list)}-01-01', 'D')
+        self.n_days = int((np.datetime64(f'{max(self.year_list) + 1}-01-01', 'D') - self.first_day).astype('int64'))
+
+        self.entities, entity_codes = np.unique(entities, return_inverse=True)
+        day_numbers = (days - self.first_day).astype('int64')
+
+        # One key per (entity, day), sorted by entity then day, and summed
+        keys, entry_index = np.unique(entity_codes * self.n_days + day_numbers, return_inverse=True)
+        self.values = np.bincount(entry_index, weights=df[value_column].to_numpy(dtype=float)[keep],
+                                  minlength=len(keys))
+        self.days = keys % self.n_days
+        self.indptr = np.searchsorted(keys // self.n_days, np.arange(len(self.entities) + 1))
+
+    @profiled('crossfilter.daily_values')
+    def daily_values(self, selected):
+        """
+        The daily totals of the selected entities, from their rows of the matrix.
+        Parameters
+        ----------
+        selected : list
+            Entities to add up. Unknown ones are ignored.
+        Returns
+        -------
+        daily_df : DataFrame
+            Columns date and value_column, for days with anything on them.
+        """
+        selected = np.asarray(selected, dtype=str)
+        codes = np.searchsorted(self.entities, selected)
+        found = codes < len(self.entities)
+        codes = codes[found][self.entities[codes[found]] == selected[found]]
+        entries = np.concatenate([np.arange(self.indptr[code], self.indptr[code + 1]) for code in codes] +
+                                 [np.array([], dtype='int64')])
+
+        days = self.days[entries]
+        totals = np.bincount(days, weights=self.values[entries], minlength=self.n_days)
+        # Days with records that add up to 0 are still days with records
+        present = np.flatnonzero(np.bincount(days, minlength=self.n_days))
+
+        return pd.DataFrame({'date': (self.first_day + present).astype('datetime64[ns]'),
+                             self.value_column: totals[present]})
+
+    def select(self, selected):
+        """
+        Shows the daily totals of the selected entities. The same as picking them in the widget.
+        """
+        self.calendar.replace(self.daily_values(selected))
+
+    def save(self, filename, **kwargs):
+        """
+        Saves the current state of the app, same as the panel save.
+        """
+        return self.layout.save(filename, **kwargs)
+
+    def servable(self, **kwargs):
+        """
+        Marks the app as servable in a Panel app.
+        """
+        return self.layout.servable(**kwargs)
+
+    def __panel__(self):
+        return self.layout
@@ -0,0 +1,129 @@
+import concurrent.futures
+import os
+import time
+import traceback
+
+def _init_worker():
+    """
+    Runs once in each worker process. Imports holoviews, bokeh and panel and initializes
+    the bokeh extension, so jobs in that worker don't pay for it again.
+    """
+    from .viz import _load_extension
+    _load_extension()
+
+def _job_result(job, future):
+    """
+    The result of a finished export future, or the error if it could not be run.
+    """
+    try:
+        return future.result()
+    except Exception:
+        # i.e. the job could not be sent to the worker, or the worker died
+        return {'path': job[-1], 'seconds': None, 'error': traceback.format_exc()}
+
+def _run_pool(jobs, indexes, processes, results):
+    """
+    Runs the jobs at indexes in one pool, filling in results. Only one job per worker is
+    handed to the pool at a time, so if a worker dies the jobs that went down with the
+    pool are exactly the ones that were running.
+    Returns
+    -------
+    broken, not_started : lists of integers
+        If the pool broke, the indexes of the jobs that were running in it, one of which
+        killed its worker, and of the jobs that were never started. Both empty otherwise.
+    """
+    not_started = list(reversed(indexes))
+    running = {}
+    broken = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as executor:
+        while not_started or running:
+            while not_started and len(running) < processes and not broken:
+                index = not_started.pop()
+                try:
+                    running[executor.submit(_export_job, jobs[index])] = index
+                except concurrent.futures.process.BrokenProcessPool:
+                    not_started.append(index)
+                    break
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                if isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool):
+                    broken.append(index)
+                else:
+                    results[index] = _job_result(jobs[index], future)
+
+    return sorted(broken), list(reversed(not_started))
+
+def _run_alone(jobs, indexes, results):
+    """
+    Runs each of the jobs at indexes in a pool of its own, so one that kills its worker
+    is reported as failed without taking any other job with it.
+    """
+    executors = [concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=_init_worker)
+                 for _ in indexes]
+    try:
+        futures = [executor.submit(_export_job, jobs[index]) for executor, index in zip(executors, indexes)]
+        for index, future in zip(indexes, futures):
+            results[index] = _job_result(jobs[index], future)
+    finally:
+        for executor in executors:
+            executor.shutdown()
+
+def _export_job(job):
+    """
+    Renders and saves a single calendar. Never raises, failures are reported back.
+    Parameters
+    ----------
+    job : tuple
+        (df, year_list, options, path), see batch_export.
+    Returns
+    -------
+    result : dict
+        With keys path, seconds and error (None if it worked, else the traceback).
+    """
+    from .viz import year_heatmap
+
+    df, year_list, options, path = job
+    start = time.perf_counter()
+    try:
+        year_heatmap(df, year_list, **options).save(path)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+
+    return {'path': path, 'seconds': time.perf_counter() - start, 'error': error}
+
+def batch_export(jobs, processes=None):
+    """
+    Renders many calendars with year_heatmap and saves them (i.e. to .html), spread
+    across a pool of processes. Each worker imports and initializes the plotting stack
+    once. A failing job is reported in the results and does not stop the others, even
+    one that kills its worker (i.e. runs out of memory): the jobs that were running
+    alongside it are retried on their own, and the rest go on in a fresh pool.
+    Parameters
+    ----------
+    jobs : iterable of tuples
+        Each job is (df, year_list, options, path). df and year_list are passed to
+        year_heatmap along with the dict of keyword arguments options, and the result
+        is saved to path.
+    processes: integer or None
+        Number of worker processes. If None, one per CPU.
+    Returns
+    -------
+    results : list of dicts
+        One per job, in the same order, with keys path, seconds (time spent rendering
+        and saving in the worker) and error (None, or the traceback as a String).
+    """
+    jobs = list(jobs)
+    results = [None] * len(jobs)
+    processes = processes or os.cpu_count() or 1
+
+    pending = list(range(len(jobs)))
+    while pending:
+        crashed, pending = _run_pool(jobs, pending, processes, results)
+        # One of these killed its worker, and can't be told apart from the others
+        _run_alone(jobs, crashed, results)
+
+    return results
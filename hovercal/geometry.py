@@ -0,0 +1,193 @@
+import pandas as pd
+import numpy as np
+
+import calendar
+import functools
+
+# How many years of calendar layout to keep around. Each year is a few hundred rows,
+# so this is small, but it keeps long running dashboard loops from growing forever.
+GEOMETRY_CACHE_SIZE = 256
+
+# The calendar columns are small numbers, so they are stored as small integers. That's
+# an eighth (a quarter for years) of the memory of int64, for millions of rows.
+CALENDAR_DTYPES = {'year': 'int16',
+                   'month': 'int8',
+                   'day': 'int8',
+                   'weekcount': 'int8',
+                   'day_of_week': 'int8'}
+
+def _weekday(days):
+    """
+    Day of the week (Monday is 0) for numpy datetime64[D] values.
+    1970-01-01 was a Thursday, hence the 3.
+    """
+    return (days.astype('int64') + 3) % 7
+
+def calendar_grid(year):
+    """
+    Lays out every day of a year on the week/day grid used by the heatmaps.
+    The layout is cached, each call hands back a copy that can be changed freely.
+    Parameters
+    ----------
+    year : integer
+        The year to lay out.
+    Returns
+    -------
+    grid_df : DataFrame
+        One row per day with columns date, year, month, day, weekcount (the column,
+        0 for the week holding January 1st), day_of_week (6 is Monday at the top,
+        0 is Sunday at the bottom) and weekday_name.
+    """
+    return _calendar_grid(year).copy()
+
+@functools.lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def _calendar_grid(year):
+    """
+    The cached layout behind calendar_grid. Treat it as read only (merging onto it,
+    like _calendar_frame does, makes a new frame).
+    """
+    days = np.arange(f'{year}-01-01', f'{year + 1}-01-01', dtype='datetime64[D]')
+    weekday = _weekday(days)
+    day_of_year = np.arange(len(days))
+    months = days.astype('datetime64[M]')
+
+    # Counting weeks from the weekday of January 1st gives the same columns as the ISO
+    # week numbers with calplot's fix-ups, without ever leaving numpy
+    grid_df = pd.DataFrame({'date': days.astype('datetime64[ns]'),
+                            'year': year,
+                            'month': months.astype('int64') % 12 + 1,
+                            'day': (days - months.astype('datetime64[D]')).astype('int64') + 1,
+                            'weekcount': (day_of_year + weekday[0]) // 7,
+                            'day_of_week': 6 - weekday,
+                            'weekday_name': np.array(calendar.day_name)[weekday]})
+
+    return grid_df.astype(CALENDAR_DTYPES)
+
+@functools.lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def month_outlines(year):
+    """
+    Vertices of the polygons that delineate each month on the grid from calendar_grid,
+    along with the x location of each month's tick. Month outline directly from
+    https://github.com/rougier/calendar-heatmap/blob/master/github-activity.py, with
+    0.5 shift because holoviews axes ticks are in the center.
+    Parameters
+    ----------
+    year : integer
+        The year to lay out.
+    Returns
+    -------
+    outlines : numpy array
+        Read only, shape (12, 8, 2). The 8 (x, y) vertices for each month.
+    tick_locations : numpy array
+        Read only, shape (12,). Where each month tick should go along the x-axis.
+    """
+    firsts = np.arange(f'{year}-01', f'{year + 1}-01', dtype='datetime64[M]')
+    lasts = (firsts + 1).astype('datetime64[D]') - 1
+    firsts = firsts.astype('datetime64[D]')
+
+    start = _weekday(firsts[:1])
+    y0 = 7 - _weekday(firsts)
+    y1 = 7 - _weekday(lasts)
+    x0 = ((firsts - firsts[0]).astype('int64') + start) // 7
+    x1 = ((lasts - firsts[0]).astype('int64') + start) // 7
+    top = np.full(12, 7)
+    bottom = np.zeros(12, dtype='int64')
+
+    outlines = np.stack([np.stack([x0, y0], axis=1),
+                         np.stack([x0 + 1, y0], axis=1),
+                         np.stack([x0 + 1, top], axis=1),
+                         np.stack([x1 + 1, top], axis=1),
+                         np.stack([x1 + 1, y1 - 1], axis=1),
+                         np.stack([x1, y1 - 1], axis=1),
+                         np.stack([x1, bottom], axis=1),
+                         np.stack([x0, bottom], axis=1)], axis=1) - 0.5
+    tick_locations = x0 - 0.5 + (x1 - x0 + 1 - 0.5) / 2
+
+    outlines.setflags(write=False)
+    tick_locations.setflags(write=False)
+
+    return outlines, tick_locations
+
+@functools.lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def month_ticks(year, month_label='Short'):
+    """
+    Month ticks for the x-axis of a single year.
+    Parameters
+    ----------
+    year : integer
+        The year to lay out.
+    month_label: String
+        Either "Short" or "Letter". Short will display abbreviations (Jan, Feb...).
+        Letter will display first letter of each month.
+    Returns
+    -------
+    monthlist : tuple of tuples
+        (x location, label) for each month.
+    """
+    _, tick_locations = month_outlines(year)
+    if month_label.lower() == 'letter':
+        labels = [calendar.month_abbr[month][:1] for month in range(1, 13)]
+    else:
+        labels = [calendar.month_abbr[month] for month in range(1, 13)]
+
+    return tuple(zip(tick_locations.tolist(), labels))
+
+def _day_ticks(day_label='Letter', offset=0):
+    """
+    Tick labels for the days of the week along the y-axis.
+    Parameters
+    ----------
+    day_label: String
+        Either "Short", "Letter", or "Full", see single_year_heatmap.
+    offset: integer
+        Added to every tick location, used when several years share one y-axis.
+    Returns
+    -------
+    yticks : list of tuples
+        (y location, label) for each day, Monday on top.
+    """
+    if day_label.lower() == 'full':
+        yticks = [(6, 'Monday'), (5, 'Tuesday'),(4, 'Wednesday'),
+                  (3, 'Thursday'), (2, 'Friday'), (1, 'Saturday'), (0, 'Sunday')]
+        
+    elif day_label.lower() == 'letter':
+        yticks = [(6, 'M'), (5, 'T'),(4, 'W'), (3, 'Th'), (2, 'F'), (1, 'Sa'), (0, 'Su')]
+        
+    else:
+        yticks = [(6, 'Mon'), (5, 'Tues'),(4, 'Wed'),
+                  (3, 'Thurs'), (2, 'Fri'), (1, 'Sat'), (0, 'Sun')]
+
+    return [(y + offset, label) for y, label in yticks]
+
+def _calendar_frame(sub_df, year):
+    """
+    Joins a single year of data onto the prebuilt calendar grid for that year.
+    Parameters
+    ----------
+    sub_df : DataFrame
+        Should have a date column. Can be sparse.
+    year : integer
+        The year being plotted.
+    Returns
+    -------
+    sub_df : DataFrame
+        One row per day of the year, with the grid columns year, month, day, weekcount,
+        day_of_week and weekday_name, and the user's values (NaN on missing days).
+    """
+    grid_df = _calendar_grid(year)
+
+    # The grid already knows where each day goes, so the user's copies of these are dropped
+    values_df = sub_df.drop(columns=[col for col in grid_df.columns if col in sub_df.columns and col != 'date'])
+    # Dates read in from a csv are strings, which would never match the grid
+    values_df = values_df.assign(date=pd.to_datetime(values_df.date).astype(grid_df.date.dtype))
+    values_df = _object_strings(values_df)
+
+    return grid_df.merge(values_df, on='date', how='left')
+
+def _object_strings(df):
+    """
+    Casts string columns to object. pandas backs strings with pyarrow when it is installed
+    (i.e. for the cache), and holoviews can't reshape those into a heatmap grid.
+    """
+    string_columns = [col for col in df.columns if isinstance(df[col].dtype, pd.StringDtype)]
+    return df.astype({col: object for col in string_columns})
@@ -0,0 +1,262 @@
+import pandas as pd
+import numpy as np
+
+import holoviews as hv
+from holoviews.core.util import match_spec
+
+from .colors import color_range
+from .geometry import _calendar_frame
+from .viz import joint_colorbar, single_year_heatmap, _compact_year_heatmap, _compact_frame, _panel_layout, _load_extension, _lookup_tables, _with_cell_colors
+
+# Carries the shared colorbar range to every year plot and to the colorbar
+ColorRange = hv.streams.Stream.define('ColorRange', cmap_min=1.0, cmap_max=1.0)
+
+def _differs(old, new):
+    """
+    Mask of the cells of a column that changed, missing values count as equal.
+    """
+    old, new = np.asarray(old), np.asarray(new)
+    return ~((old == new) | (pd.isna(old) & pd.isna(new)))
+
+# HoloViews has no public way to patch a plot's data by index, so the live patching uses
+# a few of its internals (Element._plot_id, and static_source, current_ranges and
+# _postprocess_data of ElementPlot). They are only used by the two functions below, and
+# test_year_heatmap_live_patches fails if they change (written against holoviews 1.23).
+
+def _same_plot_clone(element, data):
+    """
+    Clone of element holding data, that holoviews treats as the same plot. Its bokeh
+    source is then left alone on update (a static source), see _patch_changed_cells.
+    """
+    return element.clone(data, plot_id=element._plot_id)
+
+def _plot_data(plot, element):
+    """
+    The columns holoviews would send to the bokeh source of plot for element, which it
+    skips working out for a static source.
+    """
+    static_source, plot.static_source = plot.static_source, False
+    try:
+        data, _, _ = plot.get_data(element, match_spec(element, plot.current_ranges), plot.style[plot.cyclic_index])
+    finally:
+        plot.static_source = static_source
+    return plot._postprocess_data(data)
+
+def _patch_changed_cells(plot, element):
+    """
+    Hook of the live heatmaps. Their elements are clones of the same plot, so holoviews
+    leaves the bokeh data alone when they update, and this sends only the cells that differ
+    from what the page already has, as a ColumnDataSource patch keyed by cell index (whole
+    columns if most of their cells changed). Each page compares against its own source.
+    """
+    source = plot.handles['source']
+    data = {name: values for name, values in _plot_data(plot, element).items() if name in source.data}
+
+    if any(len(values) != len(source.data[name]) for name, values in data.items()):
+        source.data.update(data)
+        return
+
+    patches = {}
+    columns = {}
+    for name, values in data.items():
+        changed = np.flatnonzero(_differs(source.data[name], values))
+        if len(changed) > len(values) // 2:
+            columns[name] = values
+        elif len(changed):
+            patches[name] = [(int(i), values[i]) for i in changed]
+    if columns:
+        source.data.update(columns)
+    if patches:
+        source.patch(patches)
+
+class LiveCalendar:
+    """
+    A year_heatmap whose plots are backed by HoloViews streams, so new daily
+    values can be pushed into a running Panel app without rebuilding the layout.
+    Usually made with year_heatmap(..., live=True). Plots are redrawn per year (or
+    once for a compact calendar), but only the cells that changed are sent to the page.
+    Parameters
+    ----------
+    df : DataFrame
+        Should have columns for date, year, and value. Can be sparse.
+    year_list : list of integers (years)
+        Years to show, same as year_heatmap.
+    compact: Bool
+        If True, all years share one heatmap, see year_heatmap.
+    **options :
+        Any of the styling keyword arguments of year_heatmap (fig_height, cmap_color,
+        value_column, hover_columns, show_toolbar, color_scale...). A cmap_range keeps the
+        colors fixed, instead of following the maximum as data comes in.
+    """
+    def __init__(self, df, year_list, compact=False, **options):
+        _load_extension()
+
+        self.year_list = list(year_list)
+        self.compact = compact
+        self.value_column = options.get('value_column', 'value')
+        self.show_toolbar = options.pop('show_toolbar', True)
+        self.fixed_cmap_range = options.pop('cmap_range', None)
+        # Made once, so redrawn plots reuse the same lookup tables
+        if options.get('hover_lookup'):
+            options['hover_lookup'] = _lookup_tables(options['hover_lookup'])
+        self.options = options
+
+        # Keep a single row per day, indexed by date, so updates can overwrite days
+        self.df = self._by_date(df)
+
+        cmap_min, cmap_max = self._cmap_range()
+        self.color_range = ColorRange(cmap_min=cmap_min, cmap_max=cmap_max)
+
+        # In compact mode all years share one plot (and one pipe), otherwise one per year
+        if compact:
+            self.year_groups = [tuple(self.year_list)]
+        else:
+            self.year_groups = [(year,) for year in self.year_list]
+
+        self.pipes = {}
+        plot_list = []
+        for group in self.year_groups:
+            group_df = self._group_df(group)
+            self.pipes[group] = hv.streams.Pipe(data=group_df)
+            if compact:
+                overlay = _compact_year_heatmap(group_df, list(group), cmap_range=(cmap_min, cmap_max), **options)
+            else:
+                overlay = single_year_heatmap(group_df, group[0], cmap_range=(cmap_min, cmap_max), **options)
+            # Only the heatmap changes with the data, the month outlines and labels are drawn once
+            heatmap = overlay.get(0)
+            hooks = hv.Store.lookup_options('bokeh', heatmap, 'plot').kwargs.get('hooks', [])
+            heatmap = heatmap.opts(hooks=list(hooks) + [_patch_changed_cells], clone=True)
+            # Not memoized, since the pipe data is set quietly when several plots redraw at once
+            heatmap = hv.DynamicMap(hv.Callable(self._plot_callback(group, heatmap), memoize=False),
+                                    streams=[self.pipes[group], self.color_range])
+            # The overlay keeps its own options, i.e. the styling hook that has to run after
+            # holoviews sets the axes again on every redraw
+            overlay_options = hv.Store.lookup_options('bokeh', overlay, 'plot').kwargs
+            plot_list.append((heatmap * hv.Overlay(overlay.values()[1:])).opts(hv.opts.Overlay(**overlay_options)))
+
+        cmap_height = options.get('fig_height', 170) * len(self.year_list)
+        cmap_color = options.get('cmap_color', 'Blues')
+        color_scale = options.get('color_scale', 'linear')
+        cbar = hv.DynamicMap(lambda cmap_min, cmap_max: joint_colorbar(cmap_max=cmap_max,
+                                                                       cmap_height=cmap_height,
+                                                                       cmap_color=cmap_color,
+                                                                       cmap_min=cmap_min,
+                                                                       color_scale=color_scale),
+                             streams=[self.color_range])
+
+        self.layout = _panel_layout(plot_list, cbar, self.show_toolbar)
+
+    def _by_date(self, df):
+        """
+        The rows of df in year_list, one per date (the last one wins), indexed by date.
+        """
+        df = df.assign(date=pd.to_datetime(df.date))
+        return df.loc[df.date.dt.year.isin(self.year_list)].drop_duplicates('date', keep='last').set_index('date')
+
+    def _cmap_range(self):
+        """
+        Color range of the values among the years shown (or the fixed cmap_range), used for
+        the shared colorbar.
+        """
+        if self.fixed_cmap_range is not None:
+            return tuple(self.fixed_cmap_range)
+        return color_range(self.df[self.value_column],
+                           self.options.get('color_scale', 'linear'),
+                           self.options.get('clip_percentiles'))
+
+    def _group_df(self, group):
+        """
+        The rows of self.df for the years in group, with date back as a column.
+        """
+        return self.df.loc[self.df.index.year.isin(group)].reset_index()
+
+    def _plot_callback(self, group, heatmap):
+        """
+        Creates the DynamicMap callback for one plot. It lays the new data out on the
+        calendar grid and puts it into a clone of heatmap, so the styling is kept, with
+        the color range pinned to the shared colorbar.
+        """
+        compact = self.compact
+        options = self.options
+
+        def callback(data, cmap_min, cmap_max):
+            if compact:
+                frame = _compact_frame(data, list(group))
+            else:
+                frame = _calendar_frame(data, group[0])
+            if options.get('precomputed_colors'):
+                frame = _with_cell_colors(frame, self.value_column, (cmap_min, cmap_max),
+                                          options.get('cmap_color', 'Blues'),
+                                          options.get('color_scale', 'linear'),
+                                          options.get('empty_color', '#D3D3D3'))
+            # The same plot every time, so only _patch_changed_cells sends data
+            return _same_plot_clone(heatmap, frame).opts(clim=(cmap_min, cmap_max))
+
+        return callback
+
+    def update(self, new_df):
+        """
+        Adds or overwrites daily values, and pushes only the plots for the years that
+        changed, which send only the changed cells. If the maximum changes, the colorbar
+        and every plot's color range follow.
+        Parameters
+        ----------
+        new_df : DataFrame
+            Same columns as the df the calendar was made with. Days that already exist
+            are replaced, including with missing values (i.e. NaN clears a day), and keep
+            any columns new_df doesn't have. Days outside of year_list are ignored.
+        """
+        new_df = self._by_date(new_df)
+
+        # The rows of the new days, with the columns new_df doesn't have kept from before
+        new_rows = self.df.reindex(new_df.index).drop(columns=new_df.columns, errors='ignore').join(new_df)
+        self.df = pd.concat([self.df.drop(new_df.index, errors='ignore'), new_rows]).sort_index()
+
+        changed_years = set(new_df.index.year)
+        self._push([group for group in self.year_groups if changed_years.intersection(group)])
+
+    def replace(self, new_df):
+        """
+        Swaps in a whole new set of daily values and pushes every plot, i.e. when the
+        data behind the calendar is filtered differently. Days missing from new_df are
+        shown as empty.
+        Parameters
+        ----------
+        new_df : DataFrame
+            Same columns as the df the calendar was made with.
+        """
+        self.df = self._by_date(new_df)
+        self._push(self.year_groups)
+
+    def _push(self, groups):
+        """
+        Sends the current data to the plots of groups, and moves the colorbar and every
+        plot's color range if the maximum changed. Each plot redraws once, even when both
+        its data and its color range changed.
+        """
+        cmap_min, cmap_max = self._cmap_range()
+        if ((cmap_min, cmap_max) != (self.color_range.cmap_min, self.color_range.cmap_max)
+                or len(groups) == len(self.year_groups)):
+            # Every plot listens to the color range, so setting the data quietly and
+            # triggering the color range redraws them all together
+            for group in groups:
+                self.pipes[group].update(data=self._group_df(group))
+            self.color_range.event(cmap_min=cmap_min, cmap_max=cmap_max)
+        else:
+            for group in groups:
+                self.pipes[group].send(self._group_df(group))
+
+    def save(self, filename, **kwargs):
+        """
+        Saves the current state of the calendar, same as the panel save.
+        """
+        return self.layout.save(filename, **kwargs)
+
+    def servable(self, **kwargs):
+        """
+        Marks the calendar as servable in a Panel app.
+        """
+        return self.layout.servable(**kwargs)
+
+    def __panel__(self):
+        return self.layout
@@ -1,29 +1,238 @@
 import pandas as pd
 import numpy as np
 
-def df_prepper(df):
+import calendar
+import glob
+import json
+import re
+
+from .profiling import profiled, stage
+from .geometry import CALENDAR_DTYPES, _weekday
+
+# The only columns of a spotify export that spotify_cleaner needs
+SPOTIFY_COLUMNS = ['ts', 'ms_played', 'episode_show_name', 'episode_name']
+SPOTIFY_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Built in reducers of listening_totals, as the (column, aggregation) pairs pandas groupby
+# takes. play_time is turned into minutes, detail_code and skipped are made by _aggregate_plays
+REDUCERS = {'play_time': ('ms_played', 'sum'),
+            'play_count': ('ms_played', 'size'),
+            'distinct': ('detail_code', 'nunique'),
+            'skips': ('skipped', 'sum')}
+
+# The value columns of spotify_cleaner
+PODCAST_REDUCERS = {'mPlayed': 'play_time', 'unique_episodes': 'distinct'}
+
+def _is_partitioned(df):
+    """
+    True for Dask (or Dask-like) DataFrames, checked without importing dask.
+    """
+    return hasattr(df, 'map_partitions') and hasattr(df, 'compute')
+
+def df_prepper(df, inplace=False):
     """
     Creates columns for year, month, and day, based on date column
     Parameters
     ----------
     df : DataFrame
-        With column 'date' that will be used to create new columns
+        With column 'date' that will be used to create new columns. Can also be a Dask
+        DataFrame, in which case the columns are added to each partition lazily.
+    inplace: Bool
+        If False (the default), df is left as it is and a new DataFrame is returned. It
+        shares the other columns with df rather than copying them. If True, the columns
+        are added to df itself, which is also returned.
     Returns
     -------
     df : DataFrame
-        Of same length as before, but 3 extra columns. 
+        Of same length as before, but 3 extra columns: year (int16), month and day (int8).
+        If some dates are missing, the nullable Int16/Int8 are used instead.
     """
-    # Make sure its in datetime
-    df.date = pd.to_datetime(df.date)
-    
-    # Create the new cols
-    df['year'] = df['date'].dt.year
-    df['month'] = df['date'].dt.month
-    df['day'] = df['date'].dt.day
+    if _is_partitioned(df):
+        # The output columns come from running on the empty meta frame, dask's own guess
+        # feeds in made up strings that aren't dates
+        return df.map_partitions(df_prepper, meta=df_prepper(df._meta))
+
+    # Make sure its in datetime. to_datetime copies even when it already is
+    dates = df['date']
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates)
+
+    # Downcast one column at a time, so only one full size column exists at once
+    columns = {}
+    for col in ['year', 'month', 'day']:
+        values = getattr(dates.dt, col)
+        if values.hasnans:
+            # NaT has no year, the nullable integers keep the small dtype instead of float
+            columns[col] = values.astype(CALENDAR_DTYPES[col].capitalize())
+        else:
+            columns[col] = values.astype(CALENDAR_DTYPES[col])
+
+    if not inplace:
+        # With copy on write this doesn't copy the data of the other columns
+        df = df.copy(deep=False)
+    df['date'] = dates
+    for col, values in columns.items():
+        df[col] = values
 
     return df
 
-def spotify_cleaner(df, podcast_name):
+def _local_times(date_time, tz):
+    """
+    Converts naive UTC times to the naive wall time in tz. tz is a single timezone, or a
+    Series of timezone names with the same index as date_time, in which case each distinct
+    timezone is converted in one vectorized call. Rows without a timezone stay in UTC.
+    """
+    if not isinstance(tz, pd.Series):
+        return date_time.dt.tz_localize('UTC').dt.tz_convert(tz).dt.tz_localize(None)
+
+    local_times = date_time.copy()
+    zones = tz.reindex(date_time.index)
+    for zone, rows in zones.groupby(zones, sort=False).groups.items():
+        local_times.loc[rows] = _local_times(date_time.loc[rows], zone)
+
+    return local_times
+
+def _parse_timestamps(ts):
+    """
+    Parses spotify timestamps (i.e. 2022-04-02T09:20:27Z). pandas parses a string at a
+    time, pyarrow parses the whole column at once, which is many times quicker for the
+    tens of millions of records of a music history. Falls back to pandas without pyarrow,
+    or for anything pyarrow can't parse, so errors are the usual pandas ones.
+    """
+    try:
+        import pyarrow
+        import pyarrow.compute
+    except ImportError:
+        return pd.to_datetime(ts, format=SPOTIFY_TIME_FORMAT)
+    try:
+        parsed = pyarrow.compute.strptime(pyarrow.array(ts, type=pyarrow.string()),
+                                          format=SPOTIFY_TIME_FORMAT, unit='s')
+    except pyarrow.ArrowException:
+        return pd.to_datetime(ts, format=SPOTIFY_TIME_FORMAT)
+
+    # The same resolution pandas gives, which depends on the pandas version
+    dtype = pd.to_datetime(pd.Series(['2000-01-01T00:00:00Z']), format=SPOTIFY_TIME_FORMAT).dtype
+    return pd.Series(parsed.to_numpy(zero_copy_only=False).astype(dtype), index=ts.index, name=ts.name)
+
+def _parse_times(podcast_df, tz=None):
+    """
+    Adds date_time (the ts column parsed, in tz) and date (the day it falls on) columns.
+    Days are found by casting to datetime64[D], which is an integer floor division of
+    the timestamps, instead of making python date objects.
+    """
+    date_time = _parse_timestamps(podcast_df.ts)
+    if tz is not None:
+        date_time = _local_times(date_time, tz)
+
+    times = date_time.to_numpy()
+    return podcast_df.assign(date_time=date_time, date=times.astype('datetime64[D]').astype(times.dtype))
+
+@profiled('listening_totals')
+def listening_totals(df,
+                     entity_column = 'episode_show_name',
+                     entities = None,
+                     detail_column = 'episode_name',
+                     reducers = None,
+                     filters = None,
+                     by_entity = False,
+                     detail_codes = False,
+                     top_k = None,
+                     tz = None):
+    """
+    Aggregates listening records (i.e. a spotify export, music or podcasts) into one row
+    per day, ready for year_heatmap. The records are filtered with vectorized masks, and
+    every reducer is computed in a single groupby over categorical codes, so exports of
+    tens of millions of plays stay quick.
+    Parameters
+    ----------
+    df : DataFrame
+        Can be directly from spotify json's. Needs columns ts, ms_played, entity_column,
+        detail_column and the columns read by the reducers and filters.
+    entity_column: String
+        Column the records belong to, i.e. episode_show_name for podcasts or
+        master_metadata_album_artist_name for music. Records without one are dropped,
+        which keeps music and podcast plays apart.
+    entities: String, list of Strings, or None
+        Entities to keep. If None, every one.
+    detail_column: String or None
+        Column of names listed for each day, i.e. episode_name or master_metadata_track_name,
+        as a string like "{'name 1', 'name 2'}" to hover over. It is also what the distinct
+        reducer counts. If None, no names are listed, which is quicker.
+    reducers: dict or None
+        Maps each output column to a built in reducer: "play_time" (minutes played),
+        "play_count" (number of records), "distinct" (number of different detail names)
+        or "skips" (records with skipped True), or to a (column, aggregation) tuple as in
+        pandas named aggregation, i.e. ('offline', 'sum'). If None, columns mPlayed
+        (play_time), plays (play_count) and unique_names (distinct, with a detail_column).
+    filters: dict or None
+        Maps columns to the records to keep: a single value, a list (or set) of values,
+        or a function that takes the column and returns a boolean mask, i.e.
+        {'ms_played': lambda ms: ms >= 30000, 'incognito_mode': False}.
+    by_entity: Bool
+        If True, there is one row per entity and day, with entity_column in front (i.e.
+        for small_multiples or a calendar per artist). If False, the entities are added
+        up into one row per day.
+    detail_codes: Bool
+        If True, also add a detail_codes column and return the table of names the codes
+        point to, like episode_codes in spotify_cleaner.
+    top_k: integer or None
+        Only with detail_codes. Keep at most this many names per day in detail_codes, 0
+        leaves every day's detail_codes empty.
+    tz: String or Series, or None
+        Timezone the days are counted in, see spotify_cleaner.
+    Returns
+    -------
+    day_totes_df : DataFrame
+        Columns (entity_column,) date, the reducers, day, month, year, date_time and
+        detail_column (and detail_codes).
+    detail_table : list of Strings
+        Only returned if detail_codes is True. The name for each code.
+    """
+    if reducers is None:
+        reducers = {'mPlayed': 'play_time', 'plays': 'play_count'}
+        if detail_column is not None:
+            reducers['unique_names'] = 'distinct'
+    for reducer in reducers.values():
+        if isinstance(reducer, str) and reducer not in REDUCERS:
+            raise ValueError(f"unknown reducer {reducer!r}, use one of {sorted(REDUCERS)} "
+                             "or a (column, aggregation) tuple")
+
+    # Only the columns something reads are kept past the filter
+    columns = ['ts', 'ms_played']
+    if by_entity:
+        columns.append(entity_column)
+    if detail_column is not None:
+        columns.append(detail_column)
+    for reducer in reducers.values():
+        # The other built in reducers read ms_played or detail_column
+        if reducer == 'skips':
+            columns.append('skipped')
+        elif not isinstance(reducer, str):
+            columns.append(reducer[0])
+    columns = list(dict.fromkeys(columns))
+
+    with stage('listening_totals.filter'):
+        mask = df[entity_column].notna()
+        if entities is not None:
+            mask &= df[entity_column].isin([entities] if isinstance(entities, str) else entities)
+        for column, keep in (filters or {}).items():
+            if callable(keep):
+                mask &= np.asarray(keep(df[column]), dtype=bool)
+            elif isinstance(keep, (list, tuple, set, frozenset, np.ndarray, pd.Index, pd.Series)):
+                mask &= df[column].isin(keep)
+            else:
+                mask &= df[column] == keep
+        plays_df = df.loc[mask, columns]
+
+    with stage('listening_totals.parse'):
+        # Convert timestamp to datetime format, and pull out the date
+        plays_df = _parse_times(plays_df, tz)
+
+    by = [entity_column, 'date'] if by_entity else ['date']
+    return _aggregate_plays(plays_df, by, detail_column, reducers, detail_codes=detail_codes, top_k=top_k)
+
+@profiled('spotify_cleaner')
+def spotify_cleaner(df, podcast_name, episode_codes=False, top_k=None, tz=None):
     """
     Spotify data may have multiple listening records on a given day.
     This aggregates the data and calls df prepper to get the 3 day/month/year
@@ -31,42 +240,519 @@ def spotify_cleaner(df, podcast_name):
     Parameters
     ----------
     df : DataFrame
-        Can be directly from spotify json's.
+        Can be directly from spotify json's. For exports bigger than memory, df can also be
+        a Dask DataFrame (each partition is reduced to per-day, per-episode totals in
+        parallel with dask's local scheduler, then merged) or an iterable of pandas
+        DataFrames (i.e. pd.read_json(..., lines=True, chunksize=...)), which are reduced
+        one at a time. Per-row timezones need a pandas DataFrame.
     podcast_name: String
-        Name of the podcast. For now, must be podcast because it parses based on
-        episode_show_name column in the spotify data.
+        Name of the podcast, matched against the episode_show_name column. For music
+        (or any other column), see listening_totals, which this is a wrapper of.
+    episode_codes: Bool
+        If True, also add an episode_codes column: the day's episodes as comma separated
+        integer codes into episode_table, most listened to first. Hovering over
+        episode_codes with hover_lookup={'episode_codes': episode_table} in year_heatmap
+        ships each name once, instead of once per day.
+    top_k: integer or None
+        Only with episode_codes. Keep at most this many episodes per day in episode_codes,
+        0 leaves every day's episode_codes empty.
+    tz: String or Series, or None
+        Timezone the days are counted in (i.e. "America/New_York"), since a late night
+        play is on the previous day in UTC for users west of it. A Series of timezone
+        names (aligned with df) gives each row its own timezone. If None, days are UTC.
     Returns
     -------
     day_totes_df : DataFrame
         Will most likely be shorter than before, since now we have aggregated all
         listening in a single day.
+    episode_table : list of Strings
+        Only returned if episode_codes is True. The episode name for each code.
+    """
+    if not isinstance(df, pd.DataFrame):
+        with stage('spotify_cleaner.partials'):
+            if _is_partitioned(df):
+                partial_df = df.map_partitions(_spotify_partials, podcast_name, tz,
+                                               meta=_spotify_partials(df._meta, podcast_name, tz))
+                partial_df = _episode_partials(partial_df.compute())
+            else:
+                partial_df = _merge_partials(_spotify_partials(chunk, podcast_name, tz) for chunk in df)
+        return _daily_totals(partial_df, episode_codes=episode_codes, top_k=top_k)
+
+    result = listening_totals(df,
+                              'episode_show_name',
+                              [podcast_name],
+                              'episode_name',
+                              reducers=PODCAST_REDUCERS,
+                              detail_codes=episode_codes,
+                              top_k=top_k,
+                              tz=tz)
+
+    return _cleaner_columns(result, episode_codes=episode_codes)
+
+@profiled('spotify_batch_cleaner')
+def spotify_batch_cleaner(df, podcast_names=None, tz=None):
+    """
+    Same as spotify_cleaner, but for many podcasts at once. The export is filtered
+    and aggregated in a single grouped pass keyed on (show, date), so cleaning N
+    podcasts costs about the same as cleaning one.
+    Parameters
+    ----------
+    df : DataFrame
+        Can be directly from spotify json's.
+    podcast_names: list of Strings, or None
+        Names of the podcasts, matched against the episode_show_name column. If None,
+        every podcast in the export is cleaned.
+    tz: String or Series, or None
+        Timezone the days are counted in (i.e. "America/New_York"), since a late night
+        play is on the previous day in UTC for users west of it. A Series of timezone
+        names (aligned with df) gives each row its own timezone. If None, days are UTC.
+    Returns
+    -------
+    podcast_dict : dict
+        Maps each podcast name to its day_totes_df, with the same columns as
+        spotify_cleaner. Podcasts with no listening records are left out.
+    """
+    # Every podcast in one go, grouped on (show, date)
+    day_totes_df = listening_totals(df,
+                                    'episode_show_name',
+                                    podcast_names,
+                                    'episode_name',
+                                    reducers=PODCAST_REDUCERS,
+                                    by_entity=True,
+                                    tz=tz)
+    day_totes_df = _cleaner_columns(day_totes_df, by=['episode_show_name', 'date'])
+
+    # Splitting the small aggregated frame is cheap compared to filtering the export N times
+    return {show: show_df.drop(columns='episode_show_name').reset_index(drop=True)
+            for show, show_df in day_totes_df.groupby('episode_show_name', sort=False)}
+
+@profiled('period_totals')
+def period_totals(df, period='week', reducer='sum', value_column='value'):
+    """
+    Aggregates daily values into weekly or monthly cells, for year_heatmap with
+    resolution="week" or "month". Weeks are the columns of the daily calendar (week 0
+    holds January 1st), so a week spanning New Year is split between the two years,
+    same as in the daily view.
+    Parameters
+    ----------
+    df : DataFrame
+        With columns date and value_column, one row per day. Can be sparse.
+    period : String
+        Either "week" or "month".
+    reducer : String or function
+        How the days in a cell are combined, i.e. "sum", "mean" or "max". Anything
+        pandas' groupby agg takes works. Missing values are skipped.
+    value_column: String
+        Name of the column to aggregate.
+    Returns
+    -------
+    period_df : DataFrame
+        One row per cell with any days in it. Columns year, week (or month), value_column,
+        days (the number of days with a value) and start (first date of the cell).
+    """
+    if period not in ('week', 'month'):
+        raise ValueError(f"period must be 'week' or 'month', not {period!r}")
+
+    days = pd.to_datetime(df.date).to_numpy().astype('datetime64[D]')
+    new_years = days.astype('datetime64[Y]').astype('datetime64[D]')
+    if period == 'week':
+        # Same as calendar_grid's weekcount, for any mix of years at once
+        first_weekday = _weekday(new_years)
+        cells = ((days - new_years).astype('int64') + first_weekday) // 7
+        # The first week starts on January 1st, the rest on Mondays
+        starts = np.maximum(new_years + (cells * 7 - first_weekday), new_years)
+    else:
+        months = days.astype('datetime64[M]')
+        cells = months.astype('int64') % 12 + 1
+        starts = months.astype('datetime64[D]')
+
+    cells_df = pd.DataFrame({'year': new_years.astype('datetime64[Y]').astype('int64') + 1970,
+                             period: cells,
+                             value_column: df[value_column].to_numpy(),
+                             'start': starts.astype('datetime64[ns]')})
+    period_df = cells_df.groupby(['year', period], as_index=False).agg(**{value_column: (value_column, reducer),
+                                                                           'days': (value_column, 'count'),
+                                                                           'start': ('start', 'first')})
+
+    return period_df
+
+@profiled('hour_totals')
+def hour_totals(df, by='weekday', time_column='date_time', value_column=None):
+    """
+    Bins rows by hour of the day, and either day of the week or date, for hour_heatmap.
+    The bins are counted with np.bincount on integer bin numbers made from the timestamps,
+    so millions of rows take no per-row Python work.
+    Parameters
+    ----------
+    df : DataFrame
+        With a datetime column time_column, one row per event (i.e. a play). Rows with
+        a missing time are left out. Timezone aware times are binned by their local time.
+    by : String
+        Either "weekday", for a 7 x 24 grid of all days of the week, or "date", for every
+        day from the first to the last one in df x 24.
+    time_column: String
+        Name of the datetime column.
+    value_column: String or None
+        If given, the column is summed in each bin as well as counted.
+    Returns
+    -------
+    hour_df : DataFrame
+        One row per bin, including empty ones. Columns day_of_week (6 is Monday, 0 is
+        Sunday, same as the calendar grid) and weekday_name, or date, then hour, count
+        and the sum of value_column.
+    """
+    if by not in ('weekday', 'date'):
+        raise ValueError(f"by must be 'weekday' or 'date', not {by!r}")
+
+    times = pd.to_datetime(df[time_column])
+    if times.dt.tz is not None:
+        times = times.dt.tz_localize(None)
+    times = times.to_numpy()
+    # Only copy out the present rows if some are missing
+    present = ~np.isnat(times)
+    if present.all():
+        present = slice(None)
+    seconds = times[present].astype('datetime64[s]').view('int64')
+    days = seconds // 86400
+    hours = seconds // 3600 % 24
+
+    if by == 'weekday':
+        first_day, n_days = 0, 7
+        day_index = _weekday(days)
+    else:
+        first_day = days.min() if len(days) else 0
+        n_days = days.max() - first_day + 1 if len(days) else 0
+        day_index = days - first_day
+
+    # Bin number is day * 24 + hour, so bincount lays the grid out day by day
+    bins = day_index * 24 + hours
+    n_bins = n_days * 24
+    hour_df = pd.DataFrame({'hour': np.tile(np.arange(24), n_days),
+                            'count': np.bincount(bins, minlength=n_bins)})
+    if value_column is not None:
+        weights = df[value_column].to_numpy()[present].astype('float64')
+        hour_df[value_column] = np.bincount(bins, weights=weights, minlength=n_bins)
+
+    day_numbers = np.repeat(np.arange(n_days), 24)
+    if by == 'weekday':
+        hour_df.insert(0, 'day_of_week', 6 - day_numbers)
+        hour_df.insert(1, 'weekday_name', np.array(calendar.day_name)[day_numbers])
+    else:
+        hour_df.insert(0, 'date', (day_numbers + first_day).astype('datetime64[D]').astype('datetime64[ns]'))
+
+    return hour_df
+
+def spotify_hour_cleaner(df, podcast_name, by='weekday', tz=None):
+    """
+    Like spotify_cleaner, but keeps the time of day: the podcast's listening is binned
+    by hour of the day and day of the week (or date), see hour_totals and hour_heatmap.
+    Parameters
+    ----------
+    df : DataFrame
+        Can be directly from spotify json's.
+    podcast_name: String
+        Name of the podcast, matched against the episode_show_name column.
+    by : String
+        Either "weekday" or "date".
+    tz: String or Series, or None
+        Timezone the hours are counted in, see spotify_cleaner. If None, UTC.
+    Returns
+    -------
+    hour_df : DataFrame
+        Columns day_of_week and weekday_name (or date), hour, plays (the number of
+        listening records) and mPlayed (minutes played).
+    """
+    podcast_df = df.loc[df["episode_show_name"] == podcast_name, ['ts', 'ms_played']]
+    podcast_df = _parse_times(podcast_df, tz)
+
+    hour_df = hour_totals(podcast_df, by=by, value_column='ms_played')
+    hour_df['mPlayed'] = hour_df.pop('ms_played') / 60000
+
+    return hour_df.rename(columns={'count': 'plays'})
+
+def _join_groups(group_id, strings, separator):
+    """
+    Joins strings that share a group id into one string per group, in a single
+    reduceat pass. group_id must be sorted, so each group is contiguous.
+    """
+    group_starts = np.flatnonzero(np.r_[True, group_id[1:] != group_id[:-1]])
+    if len(strings) == 0:
+        return []
+    joined = np.add.reduceat(strings + separator, group_starts)
+
+    return [names[:-len(separator)] for names in joined]
+
+@profiled('aggregate_plays')
+def _aggregate_plays(plays_df, by=None, detail_column='episode_name', reducers=None, detail_codes=False, top_k=None):
     """
-    # Start by pulling out our podcast
-    podcast_df = df[df["episode_show_name"] == podcast_name].copy()
-    
-    # Convert timestamp to  datetime format.
-    podcast_df['date_time'] = list(pd.to_datetime(podcast_df.ts, format="%Y-%m-%dT%H:%M:%SZ"))
-    # Pull out the date from newly created datetime column
-    podcast_df['date'] = podcast_df['date_time'].dt.date
+    Vectorized per-day aggregation behind listening_totals and spotify_cleaner. The columns
+    grouped on (other than date) and the detail names are turned into categorical codes, so
+    every reducer runs in a single groupby over integer keys, each name is quoted once and
+    the per-day strings are built with a single join over the sorted (group, name) pairs.
+    Parameters
+    ----------
+    plays_df : DataFrame
+        With columns date, date_time, ms_played, detail_column and any columns the reducers
+        read. Either raw listening records or the partials from _episode_partials (which
+        only add up for the play_time and distinct reducers).
+    by : list of Strings, or None
+        Columns to group on. Must end with 'date'; any columns before it (i.e. the show
+        name) are kept in front of the output. If None, ['date'].
+    detail_column: String or None
+        Column of names joined into one string per day, see listening_totals.
+    reducers: dict or None
+        Output column to reducer, see listening_totals. If None, PODCAST_REDUCERS.
+    detail_codes: Bool
+        If True, also add a detail_codes column, see spotify_cleaner (episode_codes).
+    top_k: integer or None
+        Only with detail_codes, the most listened to names kept per day. 0 keeps none.
+    Returns
+    -------
+    day_totes_df : DataFrame
+        Columns by, the reducers, day, month, year, date_time and detail_column (and detail_codes).
+    detail_table : list of Strings
+        Only with detail_codes. The names the codes point to.
+    """
+    if by is None:
+        by = ['date']
+    if reducers is None:
+        reducers = PODCAST_REDUCERS
+    if detail_column is None and (detail_codes or 'distinct' in reducers.values()):
+        raise ValueError("the distinct reducer and detail_codes need a detail_column")
+    if top_k is not None and top_k < 0:
+        raise ValueError(f"top_k must be None or a number of names to keep (0 or more), not {top_k!r}")
+
+    # Group on integer codes rather than strings, the names are put back once per group
+    keys = by[:-1]
+    key_categories = {}
+    columns = {}
+    for key in keys:
+        key_values = plays_df[key].astype('category')
+        key_categories[key] = key_values.cat.categories
+        columns[key] = key_values.cat.codes.to_numpy()
+    if detail_column is not None:
+        details = plays_df[detail_column].astype('category')
+        columns['detail_code'] = details.cat.codes.to_numpy()
+    if 'skips' in reducers.values():
+        # Skipped is True, False or missing (older exports and podcasts)
+        columns['skipped'] = plays_df['skipped'].eq(True).to_numpy()
+    plays_df = plays_df.assign(**columns)
+
+    # For dates, we can just take the earliest time since we are grouping based on date,
+    # which doesn't depend on the order the rows (or files) came in.
+    # Spotify data will have the same name listed twice if you listened at different
+    # times of the day, so count unique codes.
+    aggregations = {}
+    for output, reducer in reducers.items():
+        aggregations[output] = REDUCERS[reducer] if isinstance(reducer, str) else tuple(reducer)
+    aggregations['date_time'] = ('date_time', 'min')
+    day_totes_df = plays_df.groupby(by, as_index=False).agg(**aggregations)
+    for output, reducer in reducers.items():
+        if reducer == 'play_time':
+            # Convert to minutes so it's more intuitive to look at
+            day_totes_df[output] = day_totes_df[output] / 60000
+    for key in keys:
+        day_totes_df[key] = key_categories[key].take(day_totes_df[key].to_numpy())
+
+    if detail_column is not None:
+        # Quote each name the same way str(set(...)) would. Code -1 is a missing name,
+        # which lands on the trailing entry
+        quoted = np.array([repr(name) for name in details.cat.categories] + [repr(np.nan)], dtype=object)
+
+        # One row per (group, name), in order of first listen, then ordered like the groups
+        # above so each day is contiguous
+        pairs = plays_df.drop_duplicates(by + ['detail_code'])
+        group_id = pairs.groupby(by).ngroup().to_numpy()
+        order = np.argsort(group_id, kind='stable')
+        names = _join_groups(group_id[order], quoted[pairs['detail_code'].to_numpy()[order]], ', ')
+        day_totes_df[detail_column] = ['{' + day_names + '}' for day_names in names]
+
+    if detail_codes:
+        # Most listened to name first, so top_k keeps the ones that matter
+        pair_ms = plays_df.groupby(by + ['detail_code'], as_index=False)['ms_played'].sum()
+        pair_ms['group_id'] = pair_ms.groupby(by).ngroup()
+        pair_ms = pair_ms.sort_values(['group_id', 'ms_played'], ascending=[True, False], kind='stable')
+        if top_k is not None:
+            pair_ms = pair_ms[pair_ms.groupby('group_id').cumcount() < top_k]
+
+        detail_table = [str(name) for name in details.cat.categories] + [str(np.nan)]
+        codes = pair_ms['detail_code'].to_numpy()
+        # The missing name (-1) is the last entry of the table
+        codes = np.where(codes < 0, len(detail_table) - 1, codes)
+        # Days with no names left (i.e. top_k=0) get an empty string
+        group_id = pair_ms['group_id'].to_numpy()
+        day_codes = np.full(len(day_totes_df), '', dtype=object)
+        day_codes[np.unique(group_id)] = _join_groups(group_id, codes.astype(str).astype(object), ',')
+        day_totes_df['detail_codes'] = day_codes
+
     # Make those extra cols
-    podcast_df = df_prepper(podcast_df)
-    # Convert to minutes so it's more intuitive to look at
-    podcast_df['mPlayed'] = podcast_df.ms_played / 60000
-
-    # Pull out only the columns I want. Not neccesary, but might shorten processing time depending
-    # on how long the dataset is.
-    day_totes = podcast_df[['date', 'mPlayed', 'day', 'month', 'year', 'date_time', 'episode_name' ]].copy()
-    # Find the number of unique episodes in a given day
-    day_totes['unique_episodes'] = day_totes['episode_name']
-    # Aggregate: for time, take the sum. For dates, we can just take the first since we are grouping based on date
-    # For episode name, take the set first, since spotify data will have same episode listed twice if you listened
-    # At different times of the day.
-    day_totes_df = day_totes.groupby(['date'], as_index=False).agg({'mPlayed': 'sum',
-                                                                    'day': 'first',
-                                                                    'month': 'first',
-                                                                    'year': 'first',
-                                                                    'date_time': 'first',
-                                                                   'episode_name': lambda x: str(set(list(x))),
-                                                                   'unique_episodes': lambda x: len(set(list(x)))})
-    
-    return day_totes_df
\ No newline at end of file
+    day_totes_df = df_prepper(day_totes_df, inplace=True)
+
+    columns = by + list(reducers) + ['day', 'month', 'year', 'date_time']
+    if detail_column is not None:
+        columns.append(detail_column)
+    if detail_codes:
+        return day_totes_df[columns + ['detail_codes']], detail_table
+
+    return day_totes_df[columns]
+
+def _cleaner_columns(result, by=None, episode_codes=False):
+    """
+    Puts the output of _aggregate_plays with PODCAST_REDUCERS into the columns of
+    spotify_cleaner: by (['date'] if None), mPlayed, day, month, year, date_time,
+    episode_name, unique_episodes (and episode_codes, with the episode table).
+    """
+    if by is None:
+        by = ['date']
+    columns = by + ['mPlayed', 'day', 'month', 'year', 'date_time', 'episode_name', 'unique_episodes']
+    if episode_codes:
+        day_totes_df, episode_table = result
+        day_totes_df = day_totes_df.rename(columns={'detail_codes': 'episode_codes'})
+        return day_totes_df[columns + ['episode_codes']], episode_table
+
+    return result[columns]
+
+@profiled('daily_totals')
+def _daily_totals(podcast_df, by=None, episode_codes=False, top_k=None):
+    """
+    Per-day totals with the columns of spotify_cleaner, shared by spotify_cleaner (for
+    partitioned frames), spotify_reader and cached_spotify_reader.
+    Parameters
+    ----------
+    podcast_df : DataFrame
+        With columns date, episode_name, ms_played and date_time. Either raw listening
+        records or the partials from _episode_partials.
+    by : list of Strings, or None
+        Columns to group on, see _aggregate_plays.
+    episode_codes: Bool
+        If True, also add an episode_codes column, see spotify_cleaner.
+    top_k: integer or None
+        Only with episode_codes, the most listened to episodes kept per day.
+    Returns
+    -------
+    day_totes_df : DataFrame
+        Same columns as the output of spotify_cleaner.
+    episode_table : list of Strings
+        Only with episode_codes. The names the codes point to.
+    """
+    result = _aggregate_plays(podcast_df, by, 'episode_name', PODCAST_REDUCERS,
+                              detail_codes=episode_codes, top_k=top_k)
+
+    return _cleaner_columns(result, by, episode_codes)
+
+def _episode_partials(podcast_df):
+    """
+    Reduces listening records (or earlier partials) to one row per date and episode.
+    Rows keep the order in which each (date, episode) pair was first seen, and the
+    earliest date_time, so aggregating them later on gives the same answer as
+    spotify_cleaner.
+    Parameters
+    ----------
+    podcast_df : DataFrame
+        With columns date, episode_name, ms_played and date_time.
+    Returns
+    -------
+    partial_df : DataFrame
+        Same columns, with ms_played summed and date_time the earliest.
+    """
+    return podcast_df.groupby(['date', 'episode_name'], as_index=False, sort=False, dropna=False).agg(
+                                                                    {'ms_played': 'sum',
+                                                                     'date_time': 'min'})
+
+def _read_spotify_file(file_name, podcast_name, tz=None):
+    """
+    Reads a single endsong json, keeping only SPOTIFY_COLUMNS and the rows for the
+    podcast, then reduces it to per-day, per-episode partial aggregates.
+    Parameters
+    ----------
+    file_name : String
+        Path to a spotify json (a list of listening records).
+    podcast_name: String
+        Name of the podcast, matched against episode_show_name.
+    tz: String or None
+        Timezone the days are counted in, see spotify_cleaner.
+    Returns
+    -------
+    partial_df : DataFrame
+        Output of _episode_partials for this file.
+    """
+    with open(file_name) as f:
+        records = json.load(f)
+
+    # Only build the columns we need, the raw records are dropped right after
+    podcast_df = pd.DataFrame(records, columns=SPOTIFY_COLUMNS)
+    del records
+
+    return _spotify_partials(podcast_df, podcast_name, tz)
+
+def _spotify_partials(df, podcast_name, tz=None):
+    """
+    Pulls the podcast out of a piece of a spotify export (a file, chunk or partition) and
+    reduces it to per-day, per-episode partial aggregates, see _episode_partials.
+    """
+    podcast_df = df.loc[df["episode_show_name"] == podcast_name, ['ts', 'ms_played', 'episode_name']]
+    podcast_df = _parse_times(podcast_df, tz)
+
+    return _episode_partials(podcast_df[['date', 'episode_name', 'ms_played', 'date_time']])
+
+def _natural_key(path):
+    """
+    Sort key that orders the numbers in a path by value, so endsong_2.json comes
+    before endsong_10.json.
+    """
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+def _spotify_file_list(paths):
+    """
+    Expands a glob pattern, or a list of paths, into a list of files. Matches of a
+    pattern are in natural order, the way spotify numbers its files.
+    Raises a ValueError if there are none.
+    """
+    if isinstance(paths, str):
+        file_list = sorted(glob.glob(paths), key=_natural_key)
+    else:
+        file_list = list(paths)
+    if len(file_list) == 0:
+        raise ValueError(f'No spotify json files found for {paths}')
+
+    return file_list
+
+def _merge_partials(partial_iter):
+    """
+    Folds per-file partial aggregates (see _read_spotify_file) into one partial frame.
+    Each one is merged in as soon as it arrives, so we never hold more than one file
+    worth of records. With nothing to merge (i.e. an empty chunk iterator), the partials
+    of an empty export, which still add up to the columns of spotify_cleaner.
+    """
+    partial_list = []
+    for partial_df in partial_iter:
+        partial_list = [_episode_partials(pd.concat(partial_list + [partial_df], ignore_index=True))]
+    if len(partial_list) == 0:
+        return _spotify_partials(pd.DataFrame(columns=SPOTIFY_COLUMNS), None)
+
+    return partial_list[0]
+
+@profiled('spotify_reader')
+def spotify_reader(paths, podcast_name, tz=None):
+    """
+    Streaming alternative to pd.read_json followed by spotify_cleaner. Files are
+    read one at a time and folded into per-day partial aggregates, so memory
+    depends on the number of days listened rather than the number of plays.
+    Parameters
+    ----------
+    paths : String or list of Strings
+        Either a glob pattern (i.e. './data/endsong*.json') or a list of paths to
+        spotify extended listening history json's.
+    podcast_name: String
+        Name of the podcast. Parsed based on the episode_show_name column.
+    tz: String or None
+        Timezone the days are counted in, see spotify_cleaner. Per-row timezones aren't
+        supported here, since the rows are never held in one frame.
+    Returns
+    -------
+    day_totes_df : DataFrame
+        Same columns as the output of spotify_cleaner.
+    """
+    file_list = _spotify_file_list(paths)
+
+    return _daily_totals(_merge_partials(_read_spotify_file(file_name, podcast_name, tz) for file_name in file_list))
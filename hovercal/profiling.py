@@ -0,0 +1,173 @@
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger('hovercal')
+
+# Profiles collecting records and the stages running, per thread (or asyncio task), so
+# concurrent sessions don't record each other's stages or nest under each other.
+# While there are no profiles and no callbacks, stages cost a single check.
+_active_profiles = contextvars.ContextVar('hovercal_active_profiles', default=())
+_stage_stack = contextvars.ContextVar('hovercal_stage_stack', default=())
+# Callbacks that get every record, from every thread. The tuple is replaced rather than
+# changed in place, so stages can loop over it without taking the lock.
+_callbacks = ()
+_callbacks_lock = threading.Lock()
+
+class StageProfile:
+    """
+    Collects the records of every stage run while it is active, see profile_stages.
+    Each record is a dict with keys stage, parent, seconds and allocated_mb (the net
+    memory allocated during the stage, None unless memory is being traced).
+    Parameters
+    ----------
+    log_level: integer or None
+        If set (i.e. logging.INFO), every record is also logged to the 'hovercal' logger.
+    """
+    def __init__(self, log_level=None):
+        self.records = []
+        self.log_level = log_level
+
+    def _add(self, record):
+        self.records.append(record)
+        if self.log_level is not None:
+            logger.log(self.log_level, _format_record(record))
+
+    def as_dict(self):
+        """
+        Totals per stage.
+        Returns
+        -------
+        totals : dict
+            Maps each stage name to a dict with keys calls, seconds and allocated_mb.
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {'calls': 0, 'seconds': 0.0, 'allocated_mb': None})
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            if record['allocated_mb'] is not None:
+                total['allocated_mb'] = (total['allocated_mb'] or 0.0) + record['allocated_mb']
+        return totals
+
+    def log_lines(self):
+        """
+        One line of text per stage with its totals, i.e. for logging.
+        """
+        lines = []
+        for name, total in self.as_dict().items():
+            line = f"{name}: {total['calls']} call(s), {total['seconds']:.4f} s"
+            if total['allocated_mb'] is not None:
+                line += f", {total['allocated_mb']:.2f} MB allocated"
+            lines.append(line)
+        return lines
+
+@contextlib.contextmanager
+def profile_stages(trace_memory=False, log_level=None):
+    """
+    Records wall time (and optionally memory allocation) of each hovercal stage run
+    inside the with block: spotify_cleaner, single_year_heatmap, joint_colorbar,
+    year_heatmap and their sub-stages, as well as any stage added with stage(). Only
+    stages run in the same thread (or asyncio task) as the block are recorded, so
+    profiles of concurrent sessions stay apart.
+    Example:
+        with hovercal.profile_stages() as profile:
+            panel = hovercal.year_heatmap(df, [2021])
+            with hovercal.stage('save'):
+                panel.save('cal.html')
+        profile.as_dict()
+    Parameters
+    ----------
+    trace_memory: Bool
+        If True, tracemalloc is started for the block (if it isn't already) and each
+        record gets the net MB allocated during the stage. This slows things down.
+    log_level: integer or None
+        If set (i.e. logging.INFO), every record is also logged to the 'hovercal' logger.
+    Returns
+    -------
+    profile : StageProfile
+        Filled in as stages finish.
+    """
+    profile = StageProfile(log_level)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    token = _active_profiles.set(_active_profiles.get() + (profile,))
+    try:
+        yield profile
+    finally:
+        _active_profiles.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+
+def register_callback(callback):
+    """
+    Calls callback(record) every time a stage finishes, in any thread, i.e. to send the
+    timings to a metrics system in production. See StageProfile for the keys of record.
+    """
+    global _callbacks
+    with _callbacks_lock:
+        _callbacks = _callbacks + (callback,)
+
+def unregister_callback(callback):
+    """
+    Stops calling a callback added with register_callback.
+    """
+    global _callbacks
+    with _callbacks_lock:
+        callbacks = list(_callbacks)
+        callbacks.remove(callback)
+        _callbacks = tuple(callbacks)
+
+def _format_record(record):
+    line = f"{record['stage']} took {record['seconds']:.4f} s"
+    if record['allocated_mb'] is not None:
+        line += f", allocated {record['allocated_mb']:.2f} MB"
+    return line
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the code in the with block as a stage called name, if anything is listening
+    (a profile_stages block or a registered callback). Otherwise it does nothing.
+    """
+    if not _active_profiles.get() and not _callbacks:
+        yield
+        return
+
+    tracing = tracemalloc.is_tracing()
+    stack = _stage_stack.get()
+    parent = stack[-1] if stack else None
+    token = _stage_stack.set(stack + (name,))
+    start_memory = tracemalloc.get_traced_memory()[0] if tracing else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _stage_stack.reset(token)
+        allocated_mb = None
+        if tracing and tracemalloc.is_tracing():
+            allocated_mb = (tracemalloc.get_traced_memory()[0] - start_memory) / 2**20
+        record = {'stage': name, 'parent': parent, 'seconds': seconds, 'allocated_mb': allocated_mb}
+        for profile in _active_profiles.get():
+            profile._add(record)
+        for callback in _callbacks:
+            callback(record)
+
+def profiled(name):
+    """
+    Decorator that runs the whole function as a stage called name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
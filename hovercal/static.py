@@ -0,0 +1,276 @@
+import numpy as np
+
+from xml.sax.saxutils import escape
+
+from holoviews.plotting.util import process_cmap
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from .colors import N_COLORS, cell_colors, color_range
+from .geometry import month_outlines, month_ticks, _calendar_frame, _day_ticks
+
+def _calendar_shapes(df,
+                     year_list,
+                     cell_size,
+                     cmap_color,
+                     month_separation_width,
+                     month_separation_color,
+                     month_separation_alpha,
+                     outline_color,
+                     outline_alpha,
+                     outline_width,
+                     month_label,
+                     day_label,
+                     box_separation_width,
+                     box_separation_color,
+                     box_separation_alpha,
+                     value_column,
+                     empty_color,
+                     color_scale = 'linear',
+                     clip_percentiles = None):
+    """
+    Lays out the whole calendar (years, month outlines, labels and colorbar) as a list of
+    simple shapes, in pixels. The svg and png writers only have to draw these.
+    Arguments are the same as static_year_heatmap.
+    Returns
+    -------
+    shapes : list of tuples
+        ('rect', x, y, width, height, fill, fill_alpha, line_color, line_alpha, line_width),
+        ('line', [(x, y), ...], line_color, line_alpha, line_width), or
+        ('text', x, y, text, font_size, anchor) where anchor is a two letter PIL anchor.
+    width, height : integers
+        Size of the image.
+    """
+    palette = process_cmap(cmap_color, ncolors=N_COLORS)
+    curr_df = df.loc[df.year.isin(year_list)]
+    cmap_min, cmap_max = color_range(curr_df[value_column], color_scale, clip_percentiles)
+
+    # Room for the year and day labels on the left, month labels below each year
+    left = 8 * cell_size
+    top = cell_size
+    year_height = 7 * cell_size
+    year_gap = 2 * cell_size
+    grid_width = 54 * cell_size
+    day_font = 0.7 * cell_size
+
+    shapes = []
+    for i, year in enumerate(year_list):
+        y_top = top + i * (year_height + year_gap)
+        sub_df = _calendar_frame(df.loc[df.year == year], year)
+        n_weeks = int(sub_df.weekcount.max()) + 1
+
+        # Background, shows through in the days outside of the year (like the bokeh bgcolor)
+        shapes.append(('rect', left, y_top, n_weeks * cell_size, year_height,
+                       'lightgray', 1, None, 0, 0))
+
+        # The day boxes, Monday (6) on top
+        fills = cell_colors(sub_df[value_column].to_numpy(dtype=float), cmap_min, cmap_max,
+                            cmap_color, color_scale, empty_color)
+        # The grid columns are int8, widen them before they become pixels
+        xs = left + sub_df.weekcount.to_numpy(dtype='int64') * cell_size
+        ys = y_top + (6 - sub_df.day_of_week.to_numpy(dtype='int64')) * cell_size
+        for x, y, fill in zip(xs.tolist(), ys.tolist(), fills.tolist()):
+            shapes.append(('rect', x, y, cell_size, cell_size, fill, 1,
+                           box_separation_color, box_separation_alpha, box_separation_width))
+
+        # Month outlines, from data coordinates to pixels
+        outlines, _ = month_outlines(year)
+        for P in outlines:
+            points = [(left + (x + 0.5) * cell_size, y_top + (6.5 - y) * cell_size) for x, y in P.tolist()]
+            shapes.append(('line', points + points[:1], month_separation_color,
+                           month_separation_alpha, month_separation_width))
+
+        # Border around the year
+        shapes.append(('rect', left, y_top, n_weeks * cell_size, year_height,
+                       None, 0, outline_color, outline_alpha, outline_width))
+
+        # Labels: year and days on the left, months below
+        shapes.append(('text', left - 3 * cell_size, y_top + year_height / 2, f'{year}',
+                       1.6 * cell_size, 'rm'))
+        for y, label in _day_ticks(day_label):
+            shapes.append(('text', left - 0.3 * cell_size, y_top + (6.5 - y) * cell_size, label,
+                           day_font, 'rm'))
+        for x, label in month_ticks(year, month_label):
+            shapes.append(('text', left + (x + 0.5) * cell_size, y_top + year_height + 0.3 * cell_size, label,
+                           day_font, 'mt'))
+
+    # The shared colorbar, over the height of all the years
+    bar_left = left + grid_width + cell_size
+    bar_width = cell_size
+    bar_height = len(year_list) * (year_height + year_gap) - year_gap
+    step = bar_height / N_COLORS
+    for index, color in enumerate(palette):
+        # Highest color on top
+        shapes.append(('rect', bar_left, top + bar_height - (index + 1) * step, bar_width, step,
+                       color, 1, None, 0, 0))
+    # Ticks spaced evenly along the bar, in whichever scale the colors use
+    if color_scale == 'log':
+        ticks = np.geomspace(cmap_min, cmap_max, 5)
+        positions = np.log(ticks / cmap_min) / max(np.log(cmap_max / cmap_min), np.finfo(float).eps)
+    else:
+        ticks = np.linspace(cmap_min, cmap_max, 5)
+        positions = (ticks - cmap_min) / max(cmap_max - cmap_min, np.finfo(float).eps)
+    for tick, position in zip(ticks, positions):
+        y = top + bar_height - position * bar_height
+        shapes.append(('text', bar_left + bar_width + 0.3 * cell_size, y, f'{tick:.4g}', day_font, 'lm'))
+
+    width = bar_left + bar_width + 4 * cell_size
+    height = top + bar_height + year_gap
+
+    return shapes, int(np.ceil(width)), int(np.ceil(height))
+
+def _to_svg(shapes, width, height):
+    """
+    Writes the shapes from _calendar_shapes as svg markup.
+    """
+    anchors = {'r': 'end', 'm': 'middle', 'l': 'start'}
+    baselines = {'m': 'central', 't': 'hanging'}
+    lines = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}" font-family="Helvetica, Arial, sans-serif">',
+             f'<rect width="{width}" height="{height}" fill="white"/>']
+
+    for shape in shapes:
+        if shape[0] == 'rect':
+            _, x, y, w, h, fill, fill_alpha, line_color, line_alpha, line_width = shape
+            fill = 'none' if fill is None else fill
+            stroke = 'none' if line_color is None or line_width == 0 else line_color
+            lines.append(f'<rect x="{x:.2f}" y="{y:.2f}" width="{w:.2f}" height="{h:.2f}" '
+                         f'fill="{fill}" fill-opacity="{fill_alpha}" stroke="{stroke}" '
+                         f'stroke-opacity="{line_alpha}" stroke-width="{line_width}"/>')
+        elif shape[0] == 'line':
+            _, points, line_color, line_alpha, line_width = shape
+            if line_width == 0:
+                continue
+            path = ' '.join(f'{x:.2f},{y:.2f}' for x, y in points)
+            lines.append(f'<polyline points="{path}" fill="none" stroke="{line_color}" '
+                         f'stroke-opacity="{line_alpha}" stroke-width="{line_width}"/>')
+        else:
+            _, x, y, text, font_size, anchor = shape
+            lines.append(f'<text x="{x:.2f}" y="{y:.2f}" font-size="{font_size:.1f}" '
+                         f'text-anchor="{anchors[anchor[0]]}" dominant-baseline="{baselines[anchor[1]]}">'
+                         f'{escape(text)}</text>')
+
+    lines.append('</svg>')
+
+    return '\n'.join(lines)
+
+def _rgba(color, alpha):
+    """
+    PIL color tuple from an HTML color name or hex code and an alpha between 0 and 1.
+    """
+    return ImageColor.getrgb(color)[:3] + (int(round(alpha * 255)),)
+
+def _to_png(shapes, width, height, scale=1):
+    """
+    Draws the shapes from _calendar_shapes on a PIL image. scale multiplies every
+    coordinate, for higher resolution images.
+    """
+    # Drawing RGBA colors onto an RGB image blends them, like the alphas in bokeh
+    image = Image.new('RGB', (int(width * scale), int(height * scale)), 'white')
+    draw = ImageDraw.Draw(image, 'RGBA')
+    fonts = {}
+
+    for shape in shapes:
+        if shape[0] == 'rect':
+            _, x, y, w, h, fill, fill_alpha, line_color, line_alpha, line_width = shape
+            box = [x * scale, y * scale, (x + w) * scale, (y + h) * scale]
+            if fill is not None:
+                draw.rectangle(box, fill=_rgba(fill, fill_alpha))
+            if line_color is not None and line_width > 0:
+                # PIL draws the border inside the box, bokeh and svg center it on the edge
+                half = line_width * scale / 2
+                box = [box[0] - half, box[1] - half, box[2] + half, box[3] + half]
+                draw.rectangle(box, outline=_rgba(line_color, line_alpha), width=int(round(line_width * scale)))
+        elif shape[0] == 'line':
+            _, points, line_color, line_alpha, line_width = shape
+            if line_width == 0:
+                continue
+            draw.line([(x * scale, y * scale) for x, y in points], fill=_rgba(line_color, line_alpha),
+                      width=int(round(line_width * scale)), joint='curve')
+        else:
+            _, x, y, text, font_size, anchor = shape
+            size = int(round(font_size * scale))
+            if size not in fonts:
+                fonts[size] = ImageFont.load_default(size=size)
+            draw.text((x * scale, y * scale), text, fill='black', font=fonts[size], anchor=anchor)
+
+    return image
+
+def static_year_heatmap(df,
+                        year_list,
+                        filename = None,
+                        cell_size = 18,
+                        scale = 1,
+                        cmap_color = 'Blues',
+                        month_separation_width = 2,
+                        month_separation_color = 'lightgrey',
+                        month_separation_alpha = 1,
+                        outline_color = 'black',
+                        outline_alpha = 1,
+                        outline_width = 2,
+                        month_label = 'Short',
+                        day_label = 'Letter',
+                        box_separation_width = 4,
+                        box_separation_color = 'white',
+                        box_separation_alpha = 1,
+                        value_column = 'value',
+                        empty_color = '#D3D3D3',
+                        color_scale = 'linear',
+                        clip_percentiles = None):
+    """
+    Draws the same calendar as year_heatmap (one row per year, month outlines, day and
+    month labels and the shared colorbar) as a static svg or png, without bokeh or a
+    browser. Useful for exporting lots of images.
+    Parameters
+    ----------
+    df : DataFrame
+        Should have columns for date, year, and value. Can be sparse.
+    year_list : list of integers (years)
+        Even if using 1 year, should pass in as a list.
+    filename : String or None
+        If it ends in .png, a png is saved there. Otherwise (i.e. .svg) the svg markup
+        is saved there. If None, nothing is saved.
+    cell_size : integer
+        Width and height of each day, in pixels.
+    scale : number
+        Only for png, multiplies the resolution of the image.
+    month_separation_width, month_separation_color, month_separation_alpha,
+    outline_color, outline_alpha, outline_width, month_label, day_label,
+    box_separation_width, box_separation_color, box_separation_alpha,
+    cmap_color, value_column, empty_color, color_scale, clip_percentiles :
+        Same as year_heatmap. The colors are always worked out in python here.
+    Returns
+    -------
+    output : String or PIL Image
+        The svg markup, or the PIL image if filename is a png.
+    """
+    shapes, width, height = _calendar_shapes(df,
+                                             year_list,
+                                             cell_size = cell_size,
+                                             cmap_color = cmap_color,
+                                             month_separation_width = month_separation_width,
+                                             month_separation_color = month_separation_color,
+                                             month_separation_alpha = month_separation_alpha,
+                                             outline_color = outline_color,
+                                             outline_alpha = outline_alpha,
+                                             outline_width = outline_width,
+                                             month_label = month_label,
+                                             day_label = day_label,
+                                             box_separation_width = box_separation_width,
+                                             box_separation_color = box_separation_color,
+                                             box_separation_alpha = box_separation_alpha,
+                                             value_column = value_column,
+                                             empty_color = empty_color,
+                                             color_scale = color_scale,
+                                             clip_percentiles = clip_percentiles)
+
+    if filename is not None and str(filename).lower().endswith('.png'):
+        image = _to_png(shapes, width, height, scale)
+        image.save(filename)
+        return image
+
+    svg = _to_svg(shapes, width, height)
+    if filename is not None:
+        with open(filename, 'w') as f:
+            f.write(svg)
+
+    return svg
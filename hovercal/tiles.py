@@ -0,0 +1,248 @@
+import pandas as pd
+import numpy as np
+
+import collections
+import hashlib
+import json
+import os
+import threading
+
+import bokeh
+import holoviews as hv
+import panel as pn
+from bokeh.core.json_encoder import serialize_json
+from bokeh.document import Document
+
+from . import __version__
+from .profiling import profiled, stage
+from .viz import joint_colorbar, single_year_heatmap
+
+class TileCache:
+    """
+    Keeps rendered year plots (tiles) so a dashboard that is refreshed or opened by many
+    users only renders the years whose data or styling changed. A tile is the bokeh document
+    of one plot stored as json, which loads several times quicker than holoviews renders it.
+    Tiles are kept in a bounded least recently used cache in memory, and optionally in a
+    bounded directory on disk that is shared by every process using it.
+    Parameters
+    ----------
+    cache_dir: String or None
+        Directory for the tiles on disk, created if needed. If None, tiles only live in memory.
+    max_memory_tiles: integer
+        Number of tiles kept in memory, the least recently used ones are dropped first.
+    max_disk_tiles: integer
+        Number of tile files kept in cache_dir, the least recently used ones are deleted first.
+    Tiles are keyed on the options as plain values (strings, numbers, lists and dicts of
+    them), tiles drawn with any other option (i.e. a colormap object) are not cached.
+    """
+    def __init__(self, cache_dir='.hovercal_tiles', max_memory_tiles=64, max_disk_tiles=1024):
+        self.cache_dir = cache_dir
+        self.max_memory_tiles = max_memory_tiles
+        self.max_disk_tiles = max_disk_tiles
+        # Counts of where each requested tile came from, i.e. to check a refresh hit the cache
+        self.stats = {'memory': 0, 'disk': 0, 'rendered': 0}
+        self._memory = collections.OrderedDict()
+        # Panel serves sessions from several threads
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get(self, key):
+        """
+        The tile stored under key, or None if it isn't cached.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats['memory'] += 1
+                return self._memory[key]
+
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                tile = f.read()
+        except FileNotFoundError:
+            return None
+        # The modification time is what orders the files for eviction
+        os.utime(path)
+
+        with self._lock:
+            self.stats['disk'] += 1
+            self._remember(key, tile)
+        return tile
+
+    def put(self, key, tile):
+        """
+        Stores tile (a json string) under key, in memory and on disk.
+        """
+        with self._lock:
+            self._remember(key, tile)
+
+        if self.cache_dir is None:
+            return
+        # Write next to the final file then move it in, so a crash never leaves half a tile
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(tile)
+        os.replace(tmp_path, path)
+        self._evict_disk()
+
+    def clear(self):
+        """
+        Drops every tile, in memory and on disk.
+        """
+        with self._lock:
+            self._memory.clear()
+        if self.cache_dir is not None:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _remember(self, key, tile):
+        self._memory[key] = tile
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_tiles:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    entries.append((os.stat(path).st_mtime_ns, path))
+                except FileNotFoundError:
+                    # Evicted by another process in the meantime
+                    continue
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_disk_tiles, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+
+def _plain(value):
+    """
+    value as json types, with dicts as lists of pairs in a fixed order. Raises a TypeError
+    for other objects, whose repr (i.e. one with their id in it) can change between runs.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (np.generic, np.ndarray)):
+        return _plain(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, dict):
+        return sorted([_plain(key), _plain(item)] for key, item in value.items())
+    raise TypeError(f'{type(value).__name__} is not a plain value')
+
+def _tile_key(kind, sub_df, options):
+    """
+    Cache key of a tile: a hash of the rows it draws, every option it is drawn with, and
+    the hovercal and bokeh versions (the json of a tile only loads in the same bokeh).
+    None if an option isn't a plain value, see _plain, since it has no stable key.
+    """
+    try:
+        plain_options = json.dumps(_plain(options))
+    except TypeError:
+        return None
+
+    digest = hashlib.sha256()
+    digest.update(f'{kind}|{__version__}|{bokeh.__version__}|'.encode())
+    if sub_df is not None:
+        digest.update(repr(list(zip(sub_df.columns, sub_df.dtypes.astype(str)))).encode())
+        digest.update(pd.util.hash_pandas_object(sub_df, index=False).to_numpy().tobytes())
+    digest.update(plain_options.encode())
+
+    return digest.hexdigest()
+
+@profiled('tiles.render')
+def _render_tile(obj):
+    """
+    Renders a holoviews object with bokeh and stores the resulting document as json.
+    """
+    plot = hv.renderer('bokeh').get_plot(obj)
+    doc = Document()
+    doc.add_root(plot.state)
+    # Not deferred, so the data buffers are written into the json too
+    return serialize_json(doc.to_json(deferred=False))
+
+@profiled('tiles.load')
+def _load_tile(tile):
+    """
+    Rebuilds the bokeh model of a tile into a panel pane. The models are new on every
+    load, since one bokeh model can't be shown in two documents (sessions) at once.
+    """
+    doc = Document.from_json(json.loads(tile))
+    root = doc.roots[0]
+    doc.remove_root(root)
+
+    return pn.pane.Bokeh(root)
+
+def _cached_tile(tile_cache, key, render):
+    tile = None if key is None else tile_cache.get(key)
+    if tile is None:
+        tile = render()
+        if key is not None:
+            tile_cache.put(key, tile)
+        with tile_cache._lock:
+            tile_cache.stats['rendered'] += 1
+
+    return _load_tile(tile)
+
+def _tiled_year_heatmap(df, year_list, tile_cache, cmap_range, fig_height, cmap_color, color_scale,
+                        show_toolbar, hover_columns, value_column, hover_lookup, **options):
+    """
+    The daily layout of year_heatmap, made of tiles from tile_cache. Each year is keyed on
+    its own rows, so only the years that changed (i.e. the current one) are rendered again.
+    Returns
+    -------
+    full_layout : panel object
+        A panel with heatmps on left and colorbar on right.
+    """
+    # Only the columns that are drawn, so unrelated columns changing keeps the tiles
+    columns = ['date', value_column] + [column for column in hover_columns if column not in ('date', value_column)]
+    options = dict(options,
+                   fig_height = fig_height,
+                   cmap_color = cmap_color,
+                   color_scale = color_scale,
+                   cmap_range = tuple(cmap_range),
+                   hover_columns = list(hover_columns),
+                   value_column = value_column,
+                   show_toolbar = show_toolbar,
+                   hover_lookup = hover_lookup)
+    toolbar = 'above' if show_toolbar else None
+
+    tiles = []
+    with stage('tiles.years'):
+        for year in year_list:
+            sub_df = df.loc[df.year == year]
+            key = _tile_key(f'year|{year}', sub_df[columns], options)
+
+            def render():
+                plot = single_year_heatmap(sub_df, year, **options)
+                return _render_tile(plot.opts(toolbar=toolbar))
+
+            tiles.append(_cached_tile(tile_cache, key, render))
+
+    cmap_height = fig_height * len(year_list)
+    colorbar_options = dict(cmap_max = cmap_range[1], cmap_height = cmap_height, cmap_color = cmap_color,
+                            cmap_min = cmap_range[0], color_scale = color_scale)
+    cbar = _cached_tile(tile_cache, _tile_key('colorbar', None, colorbar_options),
+                        lambda: _render_tile(joint_colorbar(**colorbar_options)))
+
+    # Same arrangement as _panel_layout
+    if show_toolbar:
+        return pn.Column(pn.Spacer(height = 20),
+                         pn.Row(pn.Column(*tiles), cbar, sizing_mode="scale_width"))
+    return pn.Column(pn.Spacer(height = 20),
+                     pn.Row(pn.Column(pn.Spacer(height = 10), *tiles), cbar, sizing_mode="scale_width"))
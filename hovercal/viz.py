@@ -4,18 +4,32 @@ import numpy as np
 import holoviews as hv
 from holoviews import opts
 
-import datetime
-import calendar
-from dateutil.relativedelta import relativedelta
-
 import bokeh
 import bokeh.io
 
 import panel as pn
 
-hv.extension('bokeh')
+import weakref
+
+from .profiling import profiled, stage
+from .prep import period_totals
+from .colors import color_range, cell_colors
+from .geometry import month_outlines, month_ticks, _calendar_frame, _calendar_grid, _day_ticks, _object_strings
+
+# hv.extension('bokeh') is slow and only needed once we plot, so it runs on first use
+_extension_loaded = False
+
+def _load_extension():
+    """
+    Initializes the holoviews bokeh extension, once per process.
+    """
+    global _extension_loaded
+    if not _extension_loaded:
+        hv.extension('bokeh')
+        _extension_loaded = True
 
-def joint_colorbar(cmap_max, cmap_height, cmap_color):
+@profiled('joint_colorbar')
+def joint_colorbar(cmap_max, cmap_height, cmap_color, cmap_min=1.0, color_scale='linear'):
     """
     Creates a holoviews colorbar that can be added to a multi-plot layout.
     Also helpful for single plots because you have more control over where it
@@ -28,13 +42,20 @@ def joint_colorbar(cmap_max, cmap_height, cmap_color):
         This will scale with number of plots. It is computed by multi_year_heatmap.
     cmap_color: color palette
         The color palette used for this instance of multi_year_heatmap.
+    cmap_min : float
+        Colorbar minimum, see color_range.
+    color_scale: String
+        Either "linear" or "log", should match the plots.
     Returns
     -------
     output : holoviews object
         A standalone color bar that can then be added to plots
     """
-    hm = hv.HeatMap([(0, 0, 1.0), (0, 1, cmap_max)]).opts(colorbar=True, 
-               clim=(1.0, cmap_max),
+    _load_extension()
+
+    hm = hv.HeatMap([(0, 0, cmap_min), (0, 1, cmap_max)]).opts(colorbar=True, 
+               clim=(cmap_min, cmap_max),
+               cnorm=color_scale,
                alpha=0,
                show_frame=False,
                frame_height=cmap_height,
@@ -49,6 +70,223 @@ def joint_colorbar(cmap_max, cmap_height, cmap_color):
     
     return hm
 
+def _month_outlines(year, month_label='Short'):
+    """
+    Month delineators and month ticks for a single year, from the cached calendar geometry.
+    Parameters
+    ----------
+    year : integer
+        The year being plotted.
+    month_label: String
+        Either "Short" or "Letter", see single_year_heatmap.
+    Returns
+    -------
+    outlines : numpy array
+        Shape (12, 8, 2), the vertices of the polygon around the days in each month.
+    monthlist : list of tuples
+        (x location, label) for each month tick.
+    """
+    outlines, _ = month_outlines(year)
+
+    return outlines, list(month_ticks(year, month_label))
+
+# Turns the comma separated codes of a looked up column into the names they point to
+_LOOKUP_CODE = "return String(value).split(',').filter(i => i.length).map(i => table[+i]).join(', ')"
+
+# The CustomJSHover of each lookup table, per rendered page (its root model). Bokeh models
+# belong to a single document, so they are made for every render instead of kept in the
+# options, and every plot of one page shares them so each table is in the page once.
+_lookup_models = weakref.WeakKeyDictionary()
+
+def _lookup_tables(hover_lookup):
+    """
+    The lookup tables of hover_lookup as tuples of names. Being plain values, they can go
+    in the options of every plot, however many documents those are rendered into.
+    Parameters
+    ----------
+    hover_lookup : dict or None
+        Maps a hover column to a list of names (a table, as returned by
+        spotify_cleaner(..., episode_codes=True)).
+    Returns
+    -------
+    tables : dict
+        Maps each column to its table as a tuple of strings.
+    """
+    return {col: table if isinstance(table, tuple) else tuple(str(name) for name in table)
+            for col, table in (hover_lookup or {}).items()}
+
+def _lookup_hook(fields):
+    """
+    Hook that sets the CustomJSHover formatters of the looked up hover fields, made once
+    per page (see _lookup_models), or per plot if it isn't rendered into a page.
+    Parameters
+    ----------
+    fields : dict
+        Maps each hover field (i.e. '@{episode_codes}') to its table from _lookup_tables.
+    """
+    def hook(plot, element):
+        from bokeh.models import CustomJSHover
+
+        hover = plot.handles.get('hover')
+        if hover is None:
+            return
+        models = {} if plot.root is None else _lookup_models.setdefault(plot.root, {})
+        formatters = dict(hover.formatters)
+        for field, table in fields.items():
+            if table not in models:
+                models[table] = CustomJSHover(args={'table': list(table)}, code=_LOOKUP_CODE)
+            formatters[field] = models[table]
+        hover.formatters = formatters
+
+    return hook
+
+def _hover_tools(value_column, hover_columns, hover_lookup):
+    """
+    The tools option of a calendar HeatMap, and the hooks it needs. Without hover_lookup it
+    is holoviews' default hover tool, otherwise a bokeh HoverTool that decodes the looked up
+    columns in the browser, with the hook that adds their formatters (see _lookup_hook).
+    """
+    if not hover_lookup:
+        return ['hover'], []
+
+    from bokeh.models import HoverTool
+
+    tables = _lookup_tables(hover_lookup)
+    tooltips = [(value_column, f'@{{{hv.core.util.dimension_sanitizer(value_column)}}}'),
+                ('date', '@{date}{%F}')]
+    fields = {}
+    for col in hover_columns:
+        field = f'@{{{hv.core.util.dimension_sanitizer(col)}}}'
+        if col in tables:
+            fields[field] = tables[col]
+            tooltips.append((col, field + '{custom}'))
+        else:
+            tooltips.append((col, field))
+
+    return [HoverTool(tooltips=tooltips, formatters={'@{date}': 'datetime'})], [_lookup_hook(fields)]
+
+def _cell_color_hook(plot, element):
+    """
+    Fills the heatmap cells straight from their cell_color column, instead of having the
+    browser map every value through the color mapper.
+    """
+    from bokeh.core.properties import field
+
+    renderer = plot.handles['glyph_renderer']
+    for glyph in [renderer.glyph, renderer.selection_glyph, renderer.nonselection_glyph,
+                  renderer.hover_glyph, renderer.muted_glyph]:
+        if hasattr(glyph, 'fill_color'):
+            glyph.fill_color = field('cell_color')
+
+def _with_cell_colors(frame, value_column, cmap_range, cmap_color, color_scale, empty_color):
+    """
+    frame with a cell_color column, the hex color of each value (see cell_colors).
+    """
+    colors = cell_colors(frame[value_column].to_numpy(dtype=float), *cmap_range, cmap_color, color_scale, empty_color)
+    # Kept as object, holoviews can't reshape pyarrow strings into the heatmap grid
+    return frame.assign(cell_color=pd.Series(colors, index=frame.index, dtype=object))
+
+def _color_options(cmap_range, color_scale, precomputed_colors, hover_dims, hook):
+    """
+    The HeatMap options that set its colors: the shared range and scale, and with
+    precomputed_colors the hook that fills the cells from cell_color (which is also kept
+    out of the hover information).
+    """
+    options = {'clim': tuple(cmap_range), 'cnorm': color_scale, 'hooks': [hook]}
+    if precomputed_colors:
+        options['hooks'].append(_cell_color_hook)
+        options['hover_tooltips'] = hover_dims
+    return options
+
+def _calendar_hook(outline_width, outline_alpha, outline_color):
+    """
+    Creates the bokeh hook shared by the calendar plots, which strips the axis lines
+    and tickmarks and styles the outline and labels.
+    Parameters
+    ----------
+    outline_width: integer
+        Line width for the outline (border).
+    outline_alpha: Integer between 0 and 1.
+        Line transparency for the outline (border).
+    outline_color: HTML color value or hex code
+        Color for the outline (border).
+    Returns
+    -------
+    hook : function
+        To be passed to the hooks option of a holoviews element.
+    """
+    def style(plot, element):
+        # Turn off the black x and y axis lines
+        plot.handles['xaxis'].axis_line_alpha = 0
+        plot.handles['yaxis'].axis_line_alpha = 0
+
+        # Add back outline to the plot of user's input
+        plot.handles['plot'].outline_line_width = outline_width
+        plot.handles['plot'].outline_line_alpha = outline_alpha
+        plot.handles['plot'].outline_line_color = outline_color
+
+        # Turn off all tickmarks
+        plot.handles['xaxis'].major_tick_line_color = None
+        plot.handles['xaxis'].minor_tick_line_color = None
+        plot.handles['yaxis'].major_tick_line_color = None
+        plot.handles['yaxis'].minor_tick_line_color = None
+        
+        # Turn off the x axis label (else it says "weekcount")
+        plot.handles['xaxis'].axis_label_text_font_size = '0pt'
+
+        # Bring the year closer, bigger, and not italics
+        plot.handles['yaxis'].axis_label_text_font_size = '25pt'
+        plot.handles['yaxis'].axis_label_text_font_style = 'normal'
+        plot.handles['yaxis'].axis_label_standoff = 10
+
+        # Bring the days of week closer and bigger
+        plot.handles['yaxis'].major_label_text_font_size = "12pt"
+        plot.handles['yaxis'].major_label_standoff = 1
+
+        # Bring the months closer and bigger
+        plot.handles['xaxis'].major_label_text_font_size = "12pt"
+        plot.handles['xaxis'].major_label_standoff = 0
+
+    # Hooks run while bokeh renders the plot, so they are timed on their own
+    def hook(plot, element):
+        with stage('hook'):
+            style(plot, element)
+
+    return hook
+
+def _year_axis_hook(year_ticks):
+    """
+    Creates the bokeh hook that labels the years of the compact calendar, as the ticks of
+    a second y-axis left of the day ticks. Text glyphs are only drawn inside the frame,
+    so the axis keeps the years visible without widening the plot.
+    Parameters
+    ----------
+    year_ticks : list of tuples
+        (y location, year) for each year, in the middle of its rows.
+    Returns
+    -------
+    hook : function
+        To be passed to the hooks option of a holoviews element.
+    """
+    from bokeh.models import FixedTicker, LinearAxis
+
+    def hook(plot, element):
+        figure = plot.handles['plot']
+        # Hooks run again whenever a live plot updates, the axis is only added once
+        if any(axis.name == 'year_axis' for axis in figure.left):
+            return
+        figure.add_layout(LinearAxis(name = 'year_axis',
+                                     ticker = FixedTicker(ticks = [y for y, _ in year_ticks]),
+                                     major_label_overrides = {y: label for y, label in year_ticks},
+                                     axis_line_alpha = 0,
+                                     major_tick_line_color = None,
+                                     minor_tick_line_color = None,
+                                     major_label_text_font_size = '20pt',
+                                     major_label_standoff = 10), 'left')
+
+    return hook
+
+@profiled('single_year_heatmap')
 def single_year_heatmap(sub_df,
                  year,
                  month_separation_width = 2,
@@ -67,7 +305,12 @@ def single_year_heatmap(sub_df,
                  show_toolbar = True,
                  hover_columns = [],
                  value_column = 'value',
-                 empty_color = '#D3D3D3'):
+                 empty_color = '#D3D3D3',
+                 hover_lookup = None,
+                 cmap_range = None,
+                 color_scale = 'linear',
+                 clip_percentiles = None,
+                 precomputed_colors = False):
     
     """
     Creates a panel layout with holoviews heatmaps and a custom colorbar, based on the
@@ -122,164 +365,569 @@ def single_year_heatmap(sub_df,
         fruit servings per day).
     empty_color: HTML color value or hex code
         The color of plot when no values exist (NaN values).
+    hover_lookup: dict or None
+        Maps hover columns that hold comma separated integer codes (i.e. episode_codes from
+        spotify_cleaner(..., episode_codes=True)) to the list of names the codes point to.
+        Those columns are decoded in the browser, so each name is stored in the plot once.
+    cmap_range: tuple of two floats, or None
+        (cmap_min, cmap_max) the colors are spread over, i.e. shared with other years. If
+        None, it is worked out from sub_df with color_scale and clip_percentiles.
+    color_scale: String
+        Either "linear" or "log", see color_range.
+    clip_percentiles: tuple of two numbers, or None
+        Percentiles of the values to spread the colors between, see color_range.
+    precomputed_colors: Bool
+        If True, the color of each day is worked out here and stored with the plot, so the
+        browser doesn't map any values to colors.
         
     Returns
     -------
     layout : holoviews object
         A holoviews layout object with a single year heatmap.
     """
+    _load_extension()
 
-    # Fill in missing days
-    idx_daily = pd.date_range(start=f'1/1/{year}', end=f'12/31/{year}')
-    sub_df = sub_df.set_index('date').reindex(idx_daily).reset_index().rename(columns={'index': 'date'})
+    if cmap_range is None:
+        cmap_range = color_range(sub_df[value_column], color_scale, clip_percentiles)
 
-    # Create new columns for year, month, and day
-    sub_df.date = pd.to_datetime(sub_df.date)
-    sub_df['year'] = sub_df['date'].dt.year
-    sub_df['month'] = sub_df['date'].dt.month
-    sub_df['day'] = sub_df['date'].dt.day
-    
-    # Get the count of the weeks, 0-52 (may be up to 54 if leap year)
-    sub_df['weekcount'] = sub_df['date'].dt.isocalendar().week
-        
-    # From calplot: https://github.com/tomkwok/calplot
-    # "There may be some days assigned to previous year's last week or
-    # next year's first week. We create new week numbers for them so
-    # the ordering stays intact and week/day pairs unique."
-    sub_df.loc[(sub_df.month == 1) & (sub_df.weekcount > 50), 'weekcount'] = 0
-    sub_df.loc[(sub_df.month == 12) & (sub_df.weekcount < 10), 'weekcount'] = sub_df.weekcount.max() + 1
-    
-    # Set the first week of the year back to 0, if it isn't there already
-    # If this isn't done, the plot will be shifted 1 column to the right
-    if sub_df.weekcount.min() == 1:
-        sub_df.weekcount -= 1
-    
-    # Flip the axes so Monday is on top (6) and Sunday is at the bottom (0)
-    # This makes the plot more intuitive
-    sub_df['day_of_week'] = 6 - sub_df['date'].dt.weekday
-    sub_df['weekday_name'] = sub_df['date'].dt.day_name()
+    # Fill in missing days and lay them out on the week/day grid
+    with stage('single_year_heatmap.grid'):
+        sub_df = _calendar_frame(sub_df, year)
 
-    # Show 0 minutes if we had an empty day, instead of NaN
-    sub_df.fillna(0)
+    hover_dims = ['weekcount', 'day_of_week', value_column, 'date', *hover_columns]
+    if precomputed_colors:
+        sub_df = _with_cell_colors(sub_df, value_column, cmap_range, cmap_color, color_scale, empty_color)
 
     # Make the base heatmap, with weekcount along the xaxis and weekday along the yaxis
     # Pass in vdims, that will be used for hovertools.
     p = hv.HeatMap(data=sub_df,
                    kdims=['weekcount', 'day_of_week'],
-                    vdims=[value_column, 'date', *hover_columns])
+                    vdims=hover_dims[2:] + ['cell_color'] * precomputed_colors)
         
-    # Month Outline directly from https://github.com/rougier/calendar-heatmap/blob/master/github-activity.py, with
-    # 0.5 shift because holoviews axes ticks are in the center.
-    start = datetime.datetime(year, 1, 1).weekday()
-    overlay_list = []
-    xticks = []
-    monthlist = []
+    # Delineate the days in each month, all 12 months closed and drawn as lines of a single Path
+    outlines, monthlist = _month_outlines(year, month_label)
+    months = hv.Path([np.concatenate([P, P[:1]]) for P in outlines])
+
+    # Create the overlay with original heatmap p and the month outlines
+    overlay = hv.Overlay([p, months])
     
-    # For each month, draw a Polygon to delineate the days in the month
-    # Loop through 1-13 because datetime is 1 indexed
-    for month in range(1, 13):
-        first = datetime.datetime(year, month, 1)
-        last = first + relativedelta(months=1, days=-1)
-        y0 = 7 - first.weekday()
-        y1 = 7 - last.weekday()
-        x0 = (int(first.strftime('%j'))+start-1)//7
-        x1 = (int(last.strftime('%j'))+start-1)//7
-        P = [(x0-0.5, y0-0.5),
-             (x0+1-0.5, y0-0.5),
-             (x0+1-0.5, 7-0.5),
-             (x1+1-0.5, 7-0.5),
-             (x1+1-0.5, y1-1-0.5),
-             (x1-0.5, y1-1-0.5),
-             (x1-0.5, 0-0.5),
-             (x0-0.5, 0-0.5) ]
-        
-        # Find where the month tick should go
-        xloc = x0-0.5 + (x1-x0+1-0.5)/2
+    hook = _calendar_hook(outline_width, outline_alpha, outline_color)
+    yticks = _day_ticks(day_label)
         
-        # Add the month tick to the list
-        if month_label.lower() == 'letter':
-            monthlist.append((xloc, calendar.month_abbr[month][:1]))
-        else:
-            monthlist.append((xloc, calendar.month_abbr[month]))
+    tools, hover_hooks = _hover_tools(value_column, hover_columns, hover_lookup)
+    color_options = _color_options(cmap_range, color_scale, precomputed_colors, hover_dims, hook)
+    color_options['hooks'].extend(hover_hooks)
 
-        # Add the polygon with vertices P to the list of Polygons to be overlaid
-        overlay_list.append(hv.Polygons(P))
-            
-    # Create the overlay with original heatmap p and 12 polygons
-    overlay = hv.Overlay([p] + overlay_list)
+    # Customize both plots.
+    overlay.opts(
+        # Styled again once the whole overlay is drawn, since holoviews sets the axes of an
+        # overlay after the hooks of its elements when it redraws (i.e. in a LiveCalendar)
+        opts.Overlay(hooks = [hook]),
+        opts.Path(line_alpha = month_separation_alpha,
+                  line_width = month_separation_width,
+                  color = month_separation_color),
+        opts.HeatMap(tools = tools,
+                     colorbar=False,
+                     width=1000,
+                     line_width = box_separation_width,
+                     line_color = box_separation_color,
+                     line_alpha = box_separation_alpha,
+                     height = fig_height,
+                     cmap = cmap_color,
+                     yticks = yticks,
+                     xticks=monthlist,
+                     ylabel = f'{year}',
+                     # toolbar = toolbar_status,
+                     bgcolor="lightgray",
+                     padding = 0.001,
+                     clipping_colors = {'NaN': empty_color},
+                     **color_options
+                    ))
     
-    def hook(plot, element):
-        # Turn off the black x and y axis lines
-        plot.handles['xaxis'].axis_line_alpha = 0
-        plot.handles['yaxis'].axis_line_alpha = 0
+    
+    return overlay
 
-        # Add back outline to the plot of user's input
-        plot.handles['plot'].outline_line_width = outline_width
-        plot.handles['plot'].outline_line_alpha = outline_alpha
-        plot.handles['plot'].outline_line_color = outline_color
+@profiled('compact_year_heatmap')
+def _compact_year_heatmap(df,
+                          year_list,
+                          fig_height = 170,
+                          cmap_color = 'Blues',
+                          month_separation_width = 2,
+                          month_separation_color = 'lightgrey',
+                          month_separation_alpha = 1,
+                          outline_color = 'black',
+                          outline_alpha = 1,
+                          outline_width = 2,
+                          month_label = 'Short',
+                          day_label = 'Letter',
+                          box_separation_width = 4,
+                          box_separation_color = 'white',
+                          box_separation_alpha = 1,
+                          hover_columns = [],
+                          value_column = 'value',
+                          empty_color = '#D3D3D3',
+                          hover_lookup = None,
+                          cmap_range = None,
+                          color_scale = 'linear',
+                          clip_percentiles = None,
+                          precomputed_colors = False):
+    """
+    Draws every year in year_list on one HeatMap, stacking the years along the y-axis
+    (first year on top). All month delineators go into a single Path and the years are
+    ticks of a second y-axis, so the number of glyphs does not grow with the number of
+    years. Arguments are the same as year_heatmap.
+    Returns
+    -------
+    overlay : holoviews object
+        Overlay of the HeatMap and the month Path.
+    """
+    _load_extension()
 
-        # Turn off all tickmarks
-        plot.handles['xaxis'].major_tick_line_color = None
-        plot.handles['xaxis'].minor_tick_line_color = None
-        plot.handles['yaxis'].major_tick_line_color = None
-        plot.handles['yaxis'].minor_tick_line_color = None
-        
-        # Turn off the x axis label (else it says "weekcount")
-        plot.handles['xaxis'].axis_label_text_font_size = '0pt'
+    path_list = []
+    yticks = []
+    year_ticks = []
+    n_years = len(year_list)
 
-        # Bring the year closer, bigger, and not italics
-        plot.handles['yaxis'].axis_label_text_font_size = '25pt'
-        plot.handles['yaxis'].axis_label_text_font_style = 'normal'
-        plot.handles['yaxis'].axis_label_standoff = 10
+    for i, year in enumerate(year_list):
+        # Each year gets its own band of 7 rows, the first year at the top
+        offset = 7 * (n_years - 1 - i)
 
-        # Bring the days of week closer and bigger
-        plot.handles['yaxis'].major_label_text_font_size = "12pt"
-        plot.handles['yaxis'].major_label_standoff = 1
+        # Close each month polygon so it can be drawn as a line
+        outlines, monthlist = _month_outlines(year, month_label)
+        path_list += [np.concatenate([P, P[:1]]) + [0, offset] for P in outlines]
+        if i == 0:
+            xticks = monthlist
 
-        # Bring the months closer and bigger
-        plot.handles['xaxis'].major_label_text_font_size = "12pt"
-        plot.handles['xaxis'].major_label_standoff = 0
+        yticks += _day_ticks(day_label, offset)
+        year_ticks.append((offset + 3, f'{year}'))
 
+    frame = _compact_frame(df, year_list)
+    if cmap_range is None:
+        cmap_range = color_range(frame[value_column], color_scale, clip_percentiles)
+    hover_dims = ['weekcount', 'day_of_week', value_column, 'date', *hover_columns]
+    if precomputed_colors:
+        # Every year at once
+        frame = _with_cell_colors(frame, value_column, cmap_range, cmap_color, color_scale, empty_color)
+
+    p = hv.HeatMap(data=frame,
+                   kdims=['weekcount', 'day_of_week'],
+                   vdims=hover_dims[2:] + ['cell_color'] * precomputed_colors)
+    months = hv.Path(path_list)
+
+    overlay = hv.Overlay([p, months])
+
+    hook = _calendar_hook(outline_width, outline_alpha, outline_color)
+    tools, hover_hooks = _hover_tools(value_column, hover_columns, hover_lookup)
+    color_options = _color_options(cmap_range, color_scale, precomputed_colors, hover_dims, hook)
+    color_options['hooks'].extend(hover_hooks)
+    color_options['hooks'].append(_year_axis_hook(year_ticks))
 
-    if day_label.lower() == 'full':
-        yticks = [(6, 'Monday'), (5, 'Tuesday'),(4, 'Wednesday'),
-                  (3, 'Thursday'), (2, 'Friday'), (1, 'Saturday'), (0, 'Sunday')]
-        
-    elif day_label.lower() == 'letter':
-        yticks = [(6, 'M'), (5, 'T'),(4, 'W'), (3, 'Th'), (2, 'F'), (1, 'Sa'), (0, 'Su')]
-        
-    else:
-        yticks = [(6, 'Mon'), (5, 'Tues'),(4, 'Wed'),
-                  (3, 'Thurs'), (2, 'Fri'), (1, 'Sat'), (0, 'Sun')]
-        
-    # Customize both plots.
     overlay.opts(
-        opts.Polygons(alpha = 0,
-                      line_alpha = month_separation_alpha, 
-                      line_width = month_separation_width,
-                      line_color = month_separation_color,
-                     hooks = [hook]),
-        opts.HeatMap(tools = ['hover'],
+        # Styled again once the whole overlay is drawn, since holoviews sets the axes of an
+        # overlay after the hooks of its elements when it redraws (i.e. in a LiveCalendar)
+        opts.Overlay(hooks = [hook]),
+        opts.Path(line_alpha = month_separation_alpha,
+                  line_width = month_separation_width,
+                  color = month_separation_color),
+        opts.HeatMap(tools = tools,
                      colorbar=False,
                      width=1000,
                      line_width = box_separation_width,
                      line_color = box_separation_color,
                      line_alpha = box_separation_alpha,
-                     height = fig_height,
+                     height = fig_height * n_years,
                      cmap = cmap_color,
                      yticks = yticks,
-                     xticks=monthlist,
-                     ylabel = f'{year}',
-                     hooks=[hook],
-                     # toolbar = toolbar_status,
+                     xticks=xticks,
+                     ylabel = '',
                      bgcolor="lightgray",
                      padding = 0.001,
-                     clipping_colors = {'NaN': empty_color}
+                     clipping_colors = {'NaN': empty_color},
+                     **color_options
                     ))
+
+    return overlay
+
+def _compact_frame(df, year_list):
+    """
+    The calendar grids of every year in year_list stacked into one frame for the compact
+    heatmap, with each year's day_of_week moved up into its own band of 7 rows.
+    """
+    dates = pd.to_datetime(df.date)
+    frame_list = []
+    n_years = len(year_list)
+
+    for i, year in enumerate(year_list):
+        sub_df = _calendar_frame(df.loc[dates.dt.year == year], year)
+        # Widened first, the offset doesn't fit in int8 for long year_lists
+        sub_df['day_of_week'] = sub_df['day_of_week'].astype('int16') + 7 * (n_years - 1 - i)
+        frame_list.append(sub_df)
+
+    return pd.concat(frame_list, ignore_index=True)
+
+@profiled('hour_heatmap')
+def hour_heatmap(hour_df,
+                 by = 'weekday',
+                 value_column = 'mPlayed',
+                 fig_height = 300,
+                 cmap_color = 'Blues',
+                 outline_color = 'black',
+                 outline_alpha = 1,
+                 outline_width = 2,
+                 day_label = 'Letter',
+                 box_separation_width = 2,
+                 box_separation_color = 'white',
+                 box_separation_alpha = 1,
+                 show_toolbar = True,
+                 hover_columns = [],
+                 empty_color = '#D3D3D3',
+                 color_scale = 'linear',
+                 clip_percentiles = None):
+    """
+    Shows when in the day things happen, from the output of hour_totals or
+    spotify_hour_cleaner. With by="weekday" it is a 7 x 24 heatmap styled like the
+    calendars, with by="date" every day is a column of 24 hours, drawn as a single image
+    so long date ranges stay quick to draw. Bins with nothing in them get empty_color.
+    Parameters
+    ----------
+    hour_df : DataFrame
+        With columns hour and value_column, and day_of_week (by="weekday") or date (by="date").
+    by : String
+        Either "weekday" or "date", matching how hour_df was made.
+    value_column: String
+        Name of the column to color by (i.e. mPlayed, plays).
+    day_label: String
+        Either "Short", "Letter", or "Full", for the day names along the y-axis (by="weekday").
+    hover_columns: list of Strings
+        Extra columns to include in the hover information (by="weekday").
+    The other styling arguments are the same as year_heatmap.
+    Returns
+    -------
+    full_layout : panel object
+        A panel with the heatmap on the left and colorbar on the right.
+    """
+    _load_extension()
+
+    if by not in ('weekday', 'date'):
+        raise ValueError(f"by must be 'weekday' or 'date', not {by!r}")
+
+    # Empty bins are NaN, so they get empty_color instead of the bottom of the colormap
+    values = hour_df[value_column].where(hour_df[value_column] > 0)
+    cmap_min, cmap_max = color_range(values, color_scale, clip_percentiles)
+    hook = _calendar_hook(outline_width, outline_alpha, outline_color)
+    hour_ticks = [(hour, f'{hour}:00') for hour in range(0, 24, 3)]
+
+    if by == 'weekday':
+        plot_df = _object_strings(hour_df.assign(**{value_column: values}))
+        plot = hv.HeatMap(data=plot_df,
+                          kdims=['hour', 'day_of_week'],
+                          vdims=[value_column, 'weekday_name', *hover_columns])
+        plot.opts(opts.HeatMap(tools = ['hover'],
+                               line_width = box_separation_width,
+                               line_color = box_separation_color,
+                               line_alpha = box_separation_alpha,
+                               yticks = _day_ticks(day_label),
+                               ylabel = ''))
+    else:
+        # One row per hour and one column per day, the days are already dense
+        dates = hour_df['date'].to_numpy()[::24]
+        grid = values.to_numpy().reshape(len(dates), 24).T
+        plot = hv.Image((dates, np.arange(24), grid), kdims=['date', 'hour'], vdims=[value_column])
+        plot.opts(opts.Image(tools = ['hover'],
+                             yticks = hour_ticks,
+                             invert_yaxis = True,
+                             ylabel = ''))
+        hour_ticks = None
+
+    plot.opts(colorbar = False,
+              width = 1000,
+              height = fig_height,
+              cmap = cmap_color,
+              clim = (cmap_min, cmap_max),
+              cnorm = color_scale,
+              hooks = [hook],
+              bgcolor = "lightgray",
+              padding = 0.001,
+              clipping_colors = {'NaN': empty_color})
+    if hour_ticks is not None:
+        plot.opts(xticks = hour_ticks)
+
+    cbar = joint_colorbar(cmap_max=cmap_max, cmap_height=fig_height, cmap_color=cmap_color,
+                          cmap_min=cmap_min, color_scale=color_scale)
+
+    return _panel_layout([plot], cbar, show_toolbar)
+
+@profiled('small_multiples')
+def small_multiples(df,
+                    entity_column,
+                    year,
+                    entities = None,
+                    n_columns = 4,
+                    fig_width = 1000,
+                    cmap_color = 'Blues',
+                    month_separation_width = 1,
+                    month_separation_color = 'lightgrey',
+                    month_separation_alpha = 1,
+                    outline_color = 'black',
+                    outline_alpha = 1,
+                    outline_width = 2,
+                    box_separation_width = 1,
+                    box_separation_color = 'white',
+                    box_separation_alpha = 1,
+                    label_size = '10pt',
+                    show_toolbar = True,
+                    hover_columns = [],
+                    value_column = 'value',
+                    empty_color = '#D3D3D3',
+                    hover_lookup = None,
+                    color_scale = 'linear',
+                    clip_percentiles = None,
+                    precomputed_colors = False):
+    """
+    Draws one calendar of year per entity (i.e. per show or per user), laid out on a grid
+    of n_columns, to compare many of them at a glance. Every calendar is a tile of a single
+    HeatMap, so they all share one data source and one color mapper, the month outlines of
+    every tile are a single Path and the names a single Labels element. The size of the
+    page grows with the number of days shown, not with the number of calendars.
+    Parameters
+    ----------
+    df : DataFrame
+        Should have columns date, entity_column and value_column, with one row per entity
+        and day (i.e. several outputs of spotify_cleaner concatenated). Can be sparse.
+    entity_column : String
+        Column naming the calendar each row belongs to.
+    year : integer
+        The year every calendar shows.
+    entities : list, or None
+        Which entities to draw and in what order (left to right, then top to bottom).
+        If None, every entity in df, in order of appearance.
+    n_columns : integer
+        Number of calendars per row of the grid.
+    fig_width : integer
+        Width of the grid in pixels. The height follows, so the days are square.
+    label_size : String
+        Font size of the name above each calendar.
+    color_scale, clip_percentiles :
+        How the colors are spread over the values, see color_range. The range is shared
+        by every calendar.
+    The other styling arguments are the same as year_heatmap. Day and month ticks are
+    left off, the date of each day is in the hover information.
+    Returns
+    -------
+    full_layout : panel object
+        A panel with the grid of calendars on the left and colorbar on the right.
+    """
+    _load_extension()
+
+    # The geometry of the year is worked out once and shifted onto each tile
+    grid_df = _calendar_grid(year)
+    outlines, _ = month_outlines(year)
+    n_days = len(grid_df)
+
+    if entities is None:
+        entities = pd.unique(df[entity_column])
+    entities = list(entities)
+    n_entities = len(entities)
+    n_rows = -(-n_entities // n_columns)
+
+    # Each tile is the 7 x (up to) 54 grid, with a column of space after it and a row
+    # above it for the name
+    tile_width = int(grid_df.weekcount.max()) + 2
+    tile_height = 9
+    tiles = np.arange(n_entities)
+    x_offsets = (tiles % n_columns) * tile_width
+    y_offsets = (n_rows - 1 - tiles // n_columns) * tile_height
+
+    # Every day of every tile, sparse values are dropped into place by position
+    with stage('small_multiples.grid'):
+        codes = pd.Index(entities).get_indexer(df[entity_column]).astype('int64')
+        day_numbers = (pd.to_datetime(df.date).to_numpy().astype('datetime64[D]')
+                       - np.datetime64(f'{year}-01-01', 'D')).astype('int64')
+        keep = (codes >= 0) & (day_numbers >= 0) & (day_numbers < n_days)
+        positions = codes[keep] * n_days + day_numbers[keep]
+
+        plot_df = pd.DataFrame({'weekcount': np.repeat(x_offsets, n_days) + np.tile(grid_df.weekcount.to_numpy(dtype='int64'), n_entities),
+                                'day_of_week': np.repeat(y_offsets, n_days) + np.tile(grid_df.day_of_week.to_numpy(dtype='int64'), n_entities),
+                                'date': np.tile(grid_df.date.to_numpy(), n_entities),
+                                entity_column: np.repeat(np.array([str(entity) for entity in entities], dtype=object), n_days)})
+        for col in [value_column, *hover_columns]:
+            values = df[col].to_numpy(dtype=float if col == value_column else object)
+            column = np.full(n_entities * n_days, np.nan, dtype=values.dtype)
+            column[positions] = values[keep]
+            plot_df[col] = column
+        plot_df = _object_strings(plot_df)
+
+    cmap_range = color_range(plot_df[value_column], color_scale, clip_percentiles)
+    hover_dims = ['weekcount', 'day_of_week', value_column, 'date', entity_column, *hover_columns]
+    if precomputed_colors:
+        # Empty days show the background, like they do without precomputed colors
+        plot_df = _with_cell_colors(plot_df, value_column, cmap_range, cmap_color, color_scale, 'transparent')
+
+    p = hv.HeatMap(data=plot_df,
+                   kdims=['weekcount', 'day_of_week'],
+                   vdims=hover_dims[2:] + ['cell_color'] * precomputed_colors)
+
+    # Closed month outlines of every tile, separated by NaN rows so they are one line
+    tile_outlines = np.concatenate([outlines, outlines[:, :1], np.full((12, 1, 2), np.nan)], axis=1)
+    tile_outlines = tile_outlines[None] + np.stack([x_offsets, y_offsets], axis=1)[:, None, None]
+    months = hv.Path([tile_outlines.reshape(-1, 2)])
+    # Names hang from the top of the row above each tile, inside the plot range
+    labels = hv.Labels((x_offsets - 0.5, y_offsets + tile_height - 0.5, [str(entity) for entity in entities]))
+    # The heatmap fills the space between tiles with NaN cells too, so those are left
+    # transparent and the empty days are colored by a background behind each tile
+    backgrounds = hv.Rectangles((x_offsets - 0.5, y_offsets - 0.5,
+                                 x_offsets + tile_width - 1.5, y_offsets + 6.5))
+
+    overlay = hv.Overlay([backgrounds, p, months, labels])
+
+    height = int(fig_width * n_rows * tile_height / (n_columns * tile_width))
+
+    hook = _calendar_hook(outline_width, outline_alpha, outline_color)
+    tools, hover_hooks = _hover_tools(value_column, [entity_column, *hover_columns], hover_lookup)
+    color_options = _color_options(cmap_range, color_scale, precomputed_colors, hover_dims, hook)
+    color_options['hooks'].extend(hover_hooks)
+
+    overlay.opts(
+        opts.Path(line_alpha = month_separation_alpha,
+                  line_width = month_separation_width,
+                  color = month_separation_color),
+        opts.Labels(text_font_size = label_size,
+                    text_align = 'left',
+                    text_baseline = 'top'),
+        opts.Rectangles(color = empty_color,
+                        line_alpha = 0),
+        opts.HeatMap(tools = tools,
+                     colorbar = False,
+                     width = fig_width,
+                     height = height,
+                     line_width = box_separation_width,
+                     line_color = box_separation_color,
+                     line_alpha = box_separation_alpha,
+                     cmap = cmap_color,
+                     xaxis = None,
+                     yaxis = None,
+                     bgcolor = "white",
+                     xlim = (-0.5, n_columns * tile_width - 1.5),
+                     ylim = (-0.5, n_rows * tile_height - 0.5),
+                     clipping_colors = {'NaN': 'transparent'},
+                     **color_options))
+
+    cbar = joint_colorbar(cmap_max=cmap_range[1], cmap_height=height, cmap_color=cmap_color,
+                          cmap_min=cmap_range[0], color_scale=color_scale)
+
+    return _panel_layout([overlay], cbar, show_toolbar)
+
+@profiled('period_heatmap')
+def _period_heatmap(period_df,
+                    year_list,
+                    period,
+                    height = 300,
+                    cmap_color = 'Blues',
+                    outline_color = 'black',
+                    outline_alpha = 1,
+                    outline_width = 2,
+                    month_label = 'Short',
+                    box_separation_width = 4,
+                    box_separation_color = 'white',
+                    box_separation_alpha = 1,
+                    value_column = 'value',
+                    empty_color = '#D3D3D3',
+                    cmap_range = (1.0, 1.0),
+                    color_scale = 'linear',
+                    precomputed_colors = False):
+    """
+    Draws the output of period_totals as a single HeatMap with one row per year (first
+    year on top) and one cell per week or month. height is the height of the plot, cmap_range the
+    (cmap_min, cmap_max) of the colors, the other arguments are the same as year_heatmap.
+    Returns
+    -------
+    plot : holoviews object
+        The HeatMap.
+    """
+    _load_extension()
+
+    n_years = len(year_list)
+    if period == 'week':
+        # Some years spill into a 54th column, only show it if one of them is here
+        cells = np.arange(max(_calendar_grid(year).weekcount.max() for year in year_list) + 1)
+        xticks = list(month_ticks(year_list[0], month_label))
+    else:
+        cells = np.arange(1, 13)
+        xticks = [(month, label) for month, (_, label) in zip(cells, month_ticks(year_list[0], month_label))]
+
+    # Every cell of every year, so empty ones get empty_color
+    grid = pd.MultiIndex.from_product([year_list, cells], names=['year', period])
+    plot_df = period_df.set_index(['year', period]).reindex(grid).reset_index()
+    plot_df['row'] = n_years - 1 - plot_df['year'].map({year: i for i, year in enumerate(year_list)})
+
+    hover_dims = [period, 'row', value_column, 'year', 'start', 'days']
+    if precomputed_colors:
+        plot_df = _with_cell_colors(plot_df, value_column, cmap_range, cmap_color, color_scale, empty_color)
+
+    p = hv.HeatMap(data=plot_df,
+                   kdims=[period, 'row'],
+                   vdims=hover_dims[2:] + ['cell_color'] * precomputed_colors)
+
+    hook = _calendar_hook(outline_width, outline_alpha, outline_color)
+
+    p.opts(opts.HeatMap(tools = ['hover'],
+                        colorbar = False,
+                        width = 1000,
+                        line_width = box_separation_width,
+                        line_color = box_separation_color,
+                        line_alpha = box_separation_alpha,
+                        height = height,
+                        cmap = cmap_color,
+                        yticks = [(n_years - 1 - i, f'{year}') for i, year in enumerate(year_list)],
+                        xticks = xticks,
+                        ylabel = '',
+                        bgcolor = "lightgray",
+                        padding = 0.001,
+                        clipping_colors = {'NaN': empty_color},
+                        **_color_options(cmap_range, color_scale, precomputed_colors, hover_dims, hook)))
+
+    return p
+
+def _panel_layout(plot_list, cbar, show_toolbar):
+    """
+    Stacks the year plots in a column and puts the colorbar on their right.
+    Parameters
+    ----------
+    plot_list : list of holoviews objects
+        One plot per year (or a single compact plot).
+    cbar : holoviews object
+        The colorbar from joint_colorbar.
+    show_toolbar: Bool
+        If True, the bokeh toolbar is shown above the plots.
+    Returns
+    -------
+    full_layout : panel object
+        A panel with heatmps on left and colorbar on right.
+    """
+    # Layout all the years first 
+    layout = hv.Layout(plot_list).cols(1)
     
+    # Figure out if we need the toolbar or not
+    if show_toolbar == True:
+        # Above is the least annoying place to put it
+        toolbar_status = 'above'
+        layout.opts(toolbar = toolbar_status)
+         # Give a little room on top because the hover tool sometimes is cut off
+        full_layout = pn.Column(pn.Spacer(height = 20), 
+                            pn.Row(pn.Column(layout), cbar, sizing_mode="scale_width"))
+        
+    else:
+        toolbar_status = None
+        layout.opts(toolbar = toolbar_status)
+
+        # For this one, also add a little space above the plots now that 
+        # the toolbar is gone. This makes the colorbar more level with the plots
+        full_layout = pn.Column(pn.Spacer(height = 20), 
+                            pn.Row(pn.Column(pn.Spacer(height = 10), layout), cbar, sizing_mode="scale_width"))
     
-    return overlay
+    return full_layout
 
+@profiled('year_heatmap')
 def year_heatmap(df,
                  year_list,
                  fig_height = 170,
@@ -298,7 +946,18 @@ def year_heatmap(df,
                  show_toolbar = True,
                  hover_columns = [],
                  value_column = 'value',
-                 empty_color = '#D3D3D3'):
+                 empty_color = '#D3D3D3',
+                 hover_lookup = None,
+                 compact = False,
+                 live = False,
+                 resolution = 'day',
+                 reducer = 'sum',
+                 drill_down = False,
+                 color_scale = 'linear',
+                 clip_percentiles = None,
+                 precomputed_colors = False,
+                 cmap_range = None,
+                 tile_cache = None):
     """
     Creates a panel layout with holoviews heatmaps and a custom colorbar, based on the
     global maximum among all years passed in. Each year plot is made by calling the
@@ -352,70 +1011,260 @@ def year_heatmap(df,
         fruit servings per day).
     empty_color: HTML color value or hex code
         The color of plot when no values exist (NaN values).
+    hover_lookup: dict or None
+        Maps hover columns that hold comma separated integer codes (i.e. episode_codes from
+        spotify_cleaner(..., episode_codes=True)) to the list of names the codes point to.
+        Those columns are decoded in the browser, and each list is stored in the saved html
+        once, however many years are shown.
+    compact: Bool
+        If True, all years are drawn on a single heatmap stacked along the y-axis, with the
+        month separators drawn as a single path. The number of plot objects then stays the same
+        however many years are shown, which makes large year_lists quicker to build, save and view.
+    live: Bool
+        If True, a LiveCalendar is returned instead. It displays the same layout, but its
+        update method pushes new or changed days (and a new colorbar maximum) into the plots
+        without rebuilding the layout, i.e. in a running Panel server.
+    resolution: String
+        Either "day", "week" or "month". With "week" or "month", the days are aggregated
+        (see period_totals) and all years are drawn as rows of a single plot, one cell per
+        week or month, so decades of data stay light. Month separators and hover_columns
+        only apply to the daily view.
+    reducer: String or function
+        How days are combined into a week or month cell, i.e. "sum", "mean" or "max".
+    drill_down: Bool
+        Only with resolution "week" or "month". If True, a year picker is added below the
+        plot, and the daily calendar of the picked year is drawn when one is picked
+        (in a notebook or Panel server).
+    color_scale: String
+        Either "linear" or "log", how the colors are spread over the values.
+    clip_percentiles: tuple of two numbers, or None
+        (low, high) percentiles of the values shown to spread the colors between, i.e. (0, 99)
+        so one outlier day doesn't wash out the rest. Days outside of it get the end colors.
+        If None, the colors go from 1.0 (linear) or the smallest value (log) to the largest
+        value. The range is worked out once over every year shown, see color_range.
+    precomputed_colors: Bool
+        If True, the color of every day is worked out in python and stored with the plots,
+        so the browser only fills in the given colors instead of mapping every value.
+    cmap_range: tuple of two numbers, or None
+        (cmap_min, cmap_max) to spread the colors between, for every resolution, the drill
+        down view and live calendars (whose colors then stay put as data comes in). If None,
+        it is worked out from the years shown with color_scale and clip_percentiles.
+    tile_cache: TileCache or None
+        If given, every year is drawn from a tile kept in the cache (see TileCache), so only
+        the years whose rows or styling changed are rendered again. Every tile is keyed on
+        the color range too, so pass a fixed cmap_range to keep the past years' tiles when
+        new data raises the maximum. Only for the daily, non compact, non live calendar.
         
     Returns
     -------
     full_layout : panel object
         A panel with heatmps on left and colorbar on right.
     """
-    # Will be populated with 1 plot per year
-    plot_list = []
-    
+    _load_extension()
+
+    if resolution not in ('day', 'week', 'month'):
+        raise ValueError(f"resolution must be 'day', 'week' or 'month', not {resolution!r}")
+    if live and resolution != 'day':
+        raise ValueError("live calendars only support resolution='day'")
+    if tile_cache is not None and (live or compact or resolution != 'day'):
+        raise ValueError("tile_cache only supports the daily, non compact, non live calendar")
+
+    if live:
+        # Imported here since live builds on the functions in this module
+        from .live import LiveCalendar
+        return LiveCalendar(df,
+                            year_list,
+                            compact = compact,
+                            fig_height = fig_height,
+                            cmap_color = cmap_color,
+                            month_separation_width = month_separation_width,
+                            month_separation_color = month_separation_color,
+                            month_separation_alpha = month_separation_alpha,
+                            outline_color = outline_color,
+                            outline_alpha = outline_alpha,
+                            outline_width = outline_width,
+                            month_label = month_label,
+                            day_label = day_label,
+                            box_separation_width = box_separation_width,
+                            box_separation_color = box_separation_color,
+                            box_separation_alpha = box_separation_alpha,
+                            show_toolbar = show_toolbar,
+                            hover_columns = hover_columns,
+                            value_column = value_column,
+                            empty_color = empty_color,
+                            hover_lookup = hover_lookup,
+                            color_scale = color_scale,
+                            clip_percentiles = clip_percentiles,
+                            precomputed_colors = precomputed_colors,
+                            cmap_range = cmap_range)
+
+    if resolution != 'day':
+        with stage('year_heatmap.periods'):
+            period_df = period_totals(df.loc[df.year.isin(year_list)], resolution, reducer, value_column)
+        # A range given by the user is kept for the daily view below too
+        period_range = cmap_range
+        if period_range is None:
+            period_range = color_range(period_df[value_column], color_scale, clip_percentiles)
+        # Each year gets about as much height as a row of days in the daily view
+        cmap_height = int(fig_height / 7 * len(year_list)) + 60
+        plot = _period_heatmap(period_df,
+                               year_list,
+                               resolution,
+                               height = cmap_height,
+                               cmap_color = cmap_color,
+                               outline_color = outline_color,
+                               outline_alpha = outline_alpha,
+                               outline_width = outline_width,
+                               month_label = month_label,
+                               box_separation_width = box_separation_width,
+                               box_separation_color = box_separation_color,
+                               box_separation_alpha = box_separation_alpha,
+                               value_column = value_column,
+                               empty_color = empty_color,
+                               cmap_range = period_range,
+                               color_scale = color_scale,
+                               precomputed_colors = precomputed_colors)
+        cbar = joint_colorbar(cmap_max = period_range[1], cmap_height = cmap_height, cmap_color = cmap_color,
+                              cmap_min = period_range[0], color_scale = color_scale)
+
+        with stage('year_heatmap.layout'):
+            full_layout = _panel_layout([plot], cbar, show_toolbar)
+        if not drill_down:
+            return full_layout
+
+        def daily_view(year):
+            # Only drawn once a year is picked
+            if year is None:
+                return None
+            return year_heatmap(df,
+                                [year],
+                                fig_height = fig_height,
+                                cmap_color = cmap_color,
+                                month_separation_width = month_separation_width,
+                                month_separation_color = month_separation_color,
+                                month_separation_alpha = month_separation_alpha,
+                                outline_color = outline_color,
+                                outline_alpha = outline_alpha,
+                                outline_width = outline_width,
+                                month_label = month_label,
+                                day_label = day_label,
+                                box_separation_width = box_separation_width,
+                                box_separation_color = box_separation_color,
+                                box_separation_alpha = box_separation_alpha,
+                                show_toolbar = show_toolbar,
+                                hover_columns = hover_columns,
+                                value_column = value_column,
+                                empty_color = empty_color,
+                                hover_lookup = hover_lookup,
+                                color_scale = color_scale,
+                                clip_percentiles = clip_percentiles,
+                                precomputed_colors = precomputed_colors,
+                                cmap_range = cmap_range)
+
+        year_select = pn.widgets.Select(label = 'Daily view',
+                                        options = {'': None, **{f'{year}': year for year in year_list}},
+                                        value = None)
+        return pn.Column(full_layout, year_select, pn.bind(daily_view, year_select))
+
     # The df may contain years that we are not going to plot
     # Pull out the current years and find the max
     curr_df = df.loc[df.year.isin(year_list)]
-    # We need this for the stand-alone colorbar
-    cmap_max = curr_df[value_column].max()
+    # We need this for the stand-alone colorbar, and every year shares it
+    if cmap_range is None:
+        cmap_range = color_range(curr_df[value_column], color_scale, clip_percentiles)
+
+    if tile_cache is not None:
+        # Imported here since tiles builds on the functions in this module
+        from .tiles import _tiled_year_heatmap
+        return _tiled_year_heatmap(df,
+                                   year_list,
+                                   tile_cache,
+                                   cmap_range,
+                                   fig_height = fig_height,
+                                   cmap_color = cmap_color,
+                                   color_scale = color_scale,
+                                   show_toolbar = show_toolbar,
+                                   hover_columns = hover_columns,
+                                   value_column = value_column,
+                                   hover_lookup = hover_lookup,
+                                   month_separation_width = month_separation_width,
+                                   month_separation_color = month_separation_color,
+                                   month_separation_alpha = month_separation_alpha,
+                                   outline_color = outline_color,
+                                   outline_alpha = outline_alpha,
+                                   outline_width = outline_width,
+                                   month_label = month_label,
+                                   day_label = day_label,
+                                   box_separation_width = box_separation_width,
+                                   box_separation_color = box_separation_color,
+                                   box_separation_alpha = box_separation_alpha,
+                                   empty_color = empty_color,
+                                   precomputed_colors = precomputed_colors)
+
+    # Turn the lookup tables into tuples once, instead of for every year
+    hover_lookup = _lookup_tables(hover_lookup)
+
+    # Will be populated with 1 plot per year
+    plot_list = []
     
-    for year in year_list:
-        # Pull out the year we are interested in
-        sub_df = df.loc[df.year == year]
+    if compact:
+        plot_list.append(_compact_year_heatmap(df,
+                                               year_list,
+                                               fig_height = fig_height,
+                                               cmap_color = cmap_color,
+                                               month_separation_width = month_separation_width,
+                                               month_separation_color = month_separation_color,
+                                               month_separation_alpha = month_separation_alpha,
+                                               outline_color = outline_color,
+                                               outline_alpha = outline_alpha,
+                                               outline_width = outline_width,
+                                               month_label = month_label,
+                                               day_label = day_label,
+                                               box_separation_width = box_separation_width,
+                                               box_separation_color = box_separation_color,
+                                               box_separation_alpha = box_separation_alpha,
+                                               hover_columns = hover_columns,
+                                               value_column = value_column,
+                                               empty_color = empty_color,
+                                               hover_lookup = hover_lookup,
+                                               cmap_range = cmap_range,
+                                               color_scale = color_scale,
+                                               precomputed_colors = precomputed_colors))
+    else:
+        for year in year_list:
+            # Pull out the year we are interested in
+            sub_df = df.loc[df.year == year]
     
-        # Call single_year_heatmap with all the neccesary info
-        plot_list.append(single_year_heatmap(sub_df=sub_df,
-                                             year=year,
-                                             month_separation_width = month_separation_width,
-                                             month_separation_color = month_separation_color,
-                                             month_separation_alpha = month_separation_alpha,
-                                             cmap_color = cmap_color,
-                                             outline_color = outline_color,
-                                             outline_alpha = outline_alpha,
-                                             outline_width = outline_width,
-                                             month_label = month_label,
-                                             day_label = day_label,
-                                             box_separation_width = box_separation_width,
-                                             box_separation_color = box_separation_color,
-                                             box_separation_alpha = box_separation_alpha,
-                                             fig_height=fig_height,
-                                             show_toolbar = show_toolbar,
-                                             hover_columns = hover_columns,
-                                             value_column = value_column,
-                                             empty_color = empty_color))
+            # Call single_year_heatmap with all the neccesary info
+            plot_list.append(single_year_heatmap(sub_df=sub_df,
+                                                 year=year,
+                                                 month_separation_width = month_separation_width,
+                                                 month_separation_color = month_separation_color,
+                                                 month_separation_alpha = month_separation_alpha,
+                                                 cmap_color = cmap_color,
+                                                 outline_color = outline_color,
+                                                 outline_alpha = outline_alpha,
+                                                 outline_width = outline_width,
+                                                 month_label = month_label,
+                                                 day_label = day_label,
+                                                 box_separation_width = box_separation_width,
+                                                 box_separation_color = box_separation_color,
+                                                 box_separation_alpha = box_separation_alpha,
+                                                 fig_height=fig_height,
+                                                 show_toolbar = show_toolbar,
+                                                 hover_columns = hover_columns,
+                                                 value_column = value_column,
+                                                 empty_color = empty_color,
+                                                 hover_lookup = hover_lookup,
+                                                 cmap_range = cmap_range,
+                                                 color_scale = color_scale,
+                                                 precomputed_colors = precomputed_colors))
 
     # Find out how tall the heatmap should be
     cmap_height = fig_height * len(year_list)
     # Create the colorbar using helper
-    cbar = joint_colorbar(cmap_max=cmap_max, cmap_height = cmap_height, cmap_color = cmap_color)
+    cbar = joint_colorbar(cmap_max=cmap_range[1], cmap_height = cmap_height, cmap_color = cmap_color,
+                          cmap_min=cmap_range[0], color_scale = color_scale)
 
-    # Layout all the years first 
-    layout = hv.Layout(plot_list).cols(1)
-    
-    # Figure out if we need the toolbar or not
-    if show_toolbar == True:
-        # Above is the least annoying place to put it
-        toolbar_status = 'above'
-        layout.opts(toolbar = toolbar_status)
-         # Give a little room on top because the hover tool sometimes is cut off
-        full_layout = pn.Column(pn.Spacer(height = 20), 
-                            pn.Row(pn.Column(layout), cbar, sizing_mode="scale_width"))
-        
-    else:
-        toolbar_status = None
-        layout.opts(toolbar = toolbar_status)
-
-        # For this one, also add a little space above the plots now that 
-        # the toolbar is gone. This makes the colorbar more level with the plots
-        full_layout = pn.Column(pn.Spacer(height = 20), 
-                            pn.Row(pn.Column(pn.Spacer(height = 10), layout), cbar, sizing_mode="scale_width"))
-    
-    return full_layout
\ No newline at end of file
+    with stage('year_heatmap.layout'):
+        return _panel_layout(plot_list, cbar, show_toolbar)
@@ -12,7 +12,8 @@ setup(
     author='Liana Merk',
     author_email='liana.merk@gmail.com',
     packages=find_packages(exclude=['docs', 'tests*']),
-    install_requires=['numpy','pandas', 'bokeh','holoviews','panel'],
+    install_requires=['numpy','pandas', 'bokeh','holoviews','panel', 'pillow'],
+    extras_require={'cache': ['pyarrow'], 'dask': ['dask[dataframe]']},
     include_package_data=True,
     classifiers=[
         "Programming Language :: Python :: 3.7",
@@ -4,6 +4,32 @@ import numpy as np
 import hovercal
 
 import datetime
+import ast
+import json
+import os
+import subprocess
+import sys
+
+
+def test_import_time():
+    # Cleaning data should not pay for the plotting stack. Run in a fresh interpreter,
+    # since this one has most likely imported it already.
+    code = ('import sys, time\n'
+            'start = time.perf_counter()\n'
+            'import hovercal\n'
+            'print(time.perf_counter() - start)\n'
+            'print(*[mod for mod in ["holoviews", "bokeh", "panel"] if mod in sys.modules])\n')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.abspath('..'), os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, check=True)
+    import_seconds, heavy_modules = output.stdout.split('\n')[:2]
+
+    print(f'import hovercal took {float(import_seconds):.3f} s')
+    assert heavy_modules == ''
+    # pandas alone is a few tenths of a second, the plotting stack is several seconds
+    assert float(import_seconds) < 1.5
+
+    # The plotting functions are still there when asked for
+    assert callable(hovercal.year_heatmap)
 
 
 def test_df_prepper():
@@ -19,6 +45,12 @@ def test_df_prepper():
     fruit_df_prepped = hovercal.df_prepper(fruit_df)
     # Check it
     assert fruit_df_prepped.shape == (24, 6)
+    # The original is untouched unless asked
+    assert fruit_df.shape == (24, 3)
+    assert list(fruit_df_prepped.dtypes[['year', 'month', 'day']]) == ['int16', 'int8', 'int8']
+    assert (fruit_df_prepped.year == fruit_df.date.dt.year).all()
+    assert hovercal.df_prepper(fruit_df, inplace=True) is fruit_df
+    assert fruit_df.shape == (24, 6)
 
     
 def test_bokeh_matplot():
@@ -28,7 +60,683 @@ def test_bokeh_matplot():
     correct_df = pd.read_csv('./podcast_df_correct.csv')
     
     assert podcast_df.shape == correct_df.shape
-    
+
+
+def test_spotify_cleaner_parity():
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    podcast_df = hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast')
+
+    correct_df = pd.read_csv('./podcast_df_correct.csv', parse_dates=['date', 'date_time'])
+
+    assert list(podcast_df.columns) == list(correct_df.columns)
+    assert (podcast_df.date.to_numpy() == correct_df.date.to_numpy()).all()
+    # date_time is the earliest play of the day, whatever order the export is in
+    podcast_ts = pd.to_datetime(spotify_df.ts[spotify_df.episode_show_name == 'The History of Egypt Podcast'],
+                                format='%Y-%m-%dT%H:%M:%SZ')
+    earliest = podcast_ts.groupby(podcast_ts.dt.normalize()).min()
+    assert (podcast_df.date_time.to_numpy() == earliest.to_numpy()).all()
+    assert np.allclose(podcast_df.mPlayed, correct_df.mPlayed)
+    for col in ['day', 'month', 'year', 'unique_episodes']:
+        assert (podcast_df[col].to_numpy() == correct_df[col].to_numpy()).all()
+    # The order inside the string is not fixed (it used to be set order), so compare as sets
+    assert ([ast.literal_eval(x) for x in podcast_df.episode_name]
+            == [ast.literal_eval(x) for x in correct_df.episode_name])
+
+
+def test_parse_timestamps():
+    from hovercal.prep import _parse_timestamps
+
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    parsed = _parse_timestamps(spotify_df.ts)
+    assert parsed.equals(pd.to_datetime(spotify_df.ts, format='%Y-%m-%dT%H:%M:%SZ'))
+
+    # Anything else goes through pandas, and fails the pandas way
+    try:
+        _parse_timestamps(pd.Series(['2021-03-14 15:25:02']))
+        assert False
+    except ValueError:
+        pass
+
+
+def test_spotify_cleaner_tz():
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    podcast_name = 'The History of Egypt Podcast'
+    utc_df = hovercal.spotify_cleaner(spotify_df, podcast_name)
+
+    local_df = hovercal.spotify_cleaner(spotify_df, podcast_name, tz = 'America/Los_Angeles')
+    podcast_df = spotify_df.loc[spotify_df.episode_show_name == podcast_name]
+    local_times = pd.to_datetime(podcast_df.ts, utc=True).dt.tz_convert('America/Los_Angeles')
+    correct = podcast_df.ms_played.groupby(local_times.dt.date.values).sum() / 60000
+    assert (local_df.date.dt.date.values == correct.index.values).all()
+    assert np.allclose(local_df.mPlayed, correct.values)
+    assert set(local_df.date) != set(utc_df.date)
+
+    # A timezone per row, with every row in UTC, is the same as no timezone
+    zones = pd.Series('UTC', index=spotify_df.index)
+    assert hovercal.spotify_cleaner(spotify_df, podcast_name, tz = zones).equals(utc_df)
+    # Mixed timezones match converting each group on its own
+    zones.iloc[::2] = 'Asia/Tokyo'
+    mixed_df = hovercal.spotify_cleaner(spotify_df, podcast_name, tz = zones)
+    assert np.isclose(mixed_df.mPlayed.sum(), utc_df.mPlayed.sum())
+
+
+def test_spotify_cleaner_partitioned():
+    import pytest
+    dd = pytest.importorskip('dask.dataframe')
+
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    podcast_df = hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast')
+
+    dask_df = dd.from_pandas(spotify_df, npartitions=4)
+    assert hovercal.spotify_cleaner(dask_df, 'The History of Egypt Podcast').equals(podcast_df)
+
+    chunks = (spotify_df.iloc[i:i + 100] for i in range(0, len(spotify_df), 100))
+    assert hovercal.spotify_cleaner(chunks, 'The History of Egypt Podcast').equals(podcast_df)
+    # No chunks at all is no days, not an error
+    empty_df = hovercal.spotify_cleaner(iter([]), 'The History of Egypt Podcast')
+    assert empty_df.empty and list(empty_df.columns) == list(podcast_df.columns)
+
+    dates_df = pd.DataFrame({'date': podcast_df.date.astype(str)})
+    prepped_df = hovercal.df_prepper(dd.from_pandas(dates_df, npartitions=3)).compute()
+    assert (prepped_df[['year', 'month', 'day']].values == podcast_df[['year', 'month', 'day']].values).all()
+
+
+def test_spotify_batch_cleaner():
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    # Make a second show out of every other record
+    spotify_df.loc[spotify_df.index[::2], 'episode_show_name'] = 'The Other Podcast'
+
+    podcast_dict = hovercal.spotify_batch_cleaner(spotify_df)
+    assert set(podcast_dict) == {'The History of Egypt Podcast', 'The Other Podcast'}
+
+    for show, batch_df in podcast_dict.items():
+        podcast_df = hovercal.spotify_cleaner(spotify_df, show)
+        assert list(batch_df.columns) == list(podcast_df.columns)
+        assert (batch_df.date == podcast_df.date).all()
+        assert (batch_df.episode_name == podcast_df.episode_name).all()
+        assert np.allclose(batch_df.mPlayed, podcast_df.mPlayed)
+
+
+def test_listening_totals():
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    podcast_df = hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast')
+
+    # The same plays as music: the show is the artist and the episodes are tracks
+    music_df = spotify_df.assign(master_metadata_album_artist_name = spotify_df.episode_show_name,
+                                 master_metadata_track_name = spotify_df.episode_name,
+                                 episode_show_name = None,
+                                 skipped = np.arange(len(spotify_df)) % 4 == 0)
+    music_kwargs = dict(entity_column = 'master_metadata_album_artist_name',
+                        detail_column = 'master_metadata_track_name')
+    assert len(hovercal.listening_totals(music_df)) == 0
+
+    artist_df = hovercal.listening_totals(music_df,
+                                          reducers = {'mPlayed': 'play_time', 'plays': 'play_count',
+                                                      'unique_tracks': 'distinct', 'skips': 'skips',
+                                                      'longest_play': ('ms_played', 'max')},
+                                          **music_kwargs)
+    assert (artist_df.date.to_numpy() == podcast_df.date.to_numpy()).all()
+    assert np.allclose(artist_df.mPlayed, podcast_df.mPlayed)
+    assert (artist_df.unique_tracks.to_numpy() == podcast_df.unique_episodes.to_numpy()).all()
+    assert (artist_df.master_metadata_track_name == podcast_df.episode_name).all()
+    assert artist_df.plays.sum() == len(spotify_df)
+    assert artist_df.skips.sum() == music_df.skipped.sum()
+    assert (artist_df.longest_play <= spotify_df.ms_played.max()).all()
+
+    # Filters drop records before anything is added up, by_entity keeps each artist apart
+    music_df.loc[music_df.index[::2], 'master_metadata_album_artist_name'] = 'Another Artist'
+    long_df = hovercal.listening_totals(music_df, filters = {'ms_played': lambda ms: ms >= 60000, 'skipped': False},
+                                        by_entity = True, **music_kwargs)
+    long_plays = music_df.loc[(music_df.ms_played >= 60000) & ~music_df.skipped]
+    assert set(long_df.master_metadata_album_artist_name) == {'The History of Egypt Podcast', 'Another Artist'}
+    assert long_df.plays.sum() == len(long_plays)
+    assert np.isclose(long_df.mPlayed.sum(), long_plays.ms_played.sum() / 60000)
+
+    # Ready for year_heatmap as it is
+    hovercal.year_heatmap(artist_df, [2021], value_column = 'plays',
+                          hover_columns = ['master_metadata_track_name']).get_root()
+
+
+def test_spotify_cleaner_episode_codes():
+    from bokeh.models import HoverTool
+
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    podcast_df = hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast')
+    coded_df, episode_table = hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast',
+                                                       episode_codes = True)
+
+    # Same days and names, the codes point at the names of each day
+    assert (coded_df.episode_name == podcast_df.episode_name).all()
+    for names, codes in zip(coded_df.episode_name, coded_df.episode_codes):
+        assert {episode_table[int(code)] for code in codes.split(',')} == ast.literal_eval(names)
+
+    top_df, _ = hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast',
+                                         episode_codes = True, top_k = 1)
+    assert (top_df.episode_codes.str.count(',') == 0).all()
+    assert (top_df.episode_codes == coded_df.episode_codes.str.split(',').str[0]).all()
+    # No episodes at all is a column of empty strings, the same days otherwise
+    none_df, _ = hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast',
+                                          episode_codes = True, top_k = 0)
+    assert (none_df.episode_codes == '').all()
+    assert none_df.drop(columns='episode_codes').equals(coded_df.drop(columns='episode_codes'))
+    try:
+        hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast', episode_codes = True, top_k = -1)
+        assert False, 'a negative top_k should raise'
+    except ValueError as error:
+        assert 'top_k' in str(error)
+
+    # The table is stored once, however many years share it
+    pod_panel = hovercal.year_heatmap(coded_df,
+                                      [2020, 2021, 2022],
+                                      hover_columns = ['episode_codes'],
+                                      hover_lookup = {'episode_codes': episode_table},
+                                      value_column = 'mPlayed')
+    hover_tools = [tool for tool in pod_panel.get_root().select({'type': HoverTool})
+                   if '@{episode_codes}' in tool.formatters]
+    formatters = {id(tool.formatters['@{episode_codes}']) for tool in hover_tools}
+    assert len(hover_tools) == 3
+    assert len(formatters) == 1
+
+    # Every session renders the same layout into its own document, with its own formatter
+    from bokeh.document import Document
+    live_cal = hovercal.year_heatmap(coded_df, [2020, 2021], hover_columns = ['episode_codes'],
+                                     hover_lookup = {'episode_codes': episode_table},
+                                     value_column = 'mPlayed', live = True)
+    for layout in [pod_panel, live_cal.layout]:
+        session_formatters = []
+        for _ in range(2):
+            doc = Document()
+            root = layout.get_root(doc)
+            doc.add_root(root)
+            hover_tools = [tool for tool in root.select({'type': HoverTool})
+                           if '@{episode_codes}' in tool.formatters]
+            formatters = {id(tool.formatters['@{episode_codes}']) for tool in hover_tools}
+            assert len(formatters) == 1
+            assert hover_tools[0].formatters['@{episode_codes}'].document is doc
+            session_formatters.append(formatters)
+        assert session_formatters[0] != session_formatters[1]
+
+
+def test_hour_totals():
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    podcast_df = spotify_df.loc[spotify_df.episode_show_name == 'The History of Egypt Podcast']
+    times = pd.to_datetime(podcast_df.ts)
+    correct = podcast_df.groupby([times.dt.dayofweek, times.dt.hour]).ms_played.sum() / 60000
+
+    hour_df = hovercal.spotify_hour_cleaner(spotify_df, 'The History of Egypt Podcast')
+    assert len(hour_df) == 7 * 24
+    assert hour_df.plays.sum() == len(podcast_df)
+    binned = hour_df.set_index([6 - hour_df.day_of_week, 'hour']).mPlayed
+    assert np.allclose(binned.loc[correct.index], correct)
+    assert np.isclose(binned.sum(), correct.sum())
+
+    date_df = hovercal.spotify_hour_cleaner(spotify_df, 'The History of Egypt Podcast', by = 'date')
+    assert len(date_df) == 24 * ((times.max().normalize() - times.min().normalize()).days + 1)
+    assert np.isclose(date_df.mPlayed.sum(), correct.sum())
+
+    for by, plot_df in [('weekday', hour_df), ('date', date_df)]:
+        hovercal.hour_heatmap(plot_df, by = by).get_root()
+
+
+def test_spotify_reader(tmp_path):
+    # Split the test export into a few endsong files, like a real request, with the
+    # later plays in the files that are read first
+    with open('./endsong_data.json') as f:
+        records = json.load(f)
+    for i, number in enumerate([10, 2, 1]):
+        with open(tmp_path / f'endsong_{number}.json', 'w') as f:
+            json.dump(records[i::3], f)
+
+    # Numbered files are read in order
+    file_list = hovercal.prep._spotify_file_list(str(tmp_path / 'endsong_*.json'))
+    assert [os.path.basename(file_name) for file_name in file_list] == ['endsong_1.json', 'endsong_2.json', 'endsong_10.json']
+
+    streamed_df = hovercal.spotify_reader(str(tmp_path / 'endsong_*.json'), 'The History of Egypt Podcast')
+    podcast_df = hovercal.spotify_cleaner(pd.read_json('./endsong_data.json', lines=False),
+                                          'The History of Egypt Podcast')
+
+    assert list(streamed_df.columns) == list(podcast_df.columns)
+    # The names of a day can come in another order, everything else matches exactly
+    pd.testing.assert_frame_equal(streamed_df.drop(columns='episode_name'),
+                                  podcast_df.drop(columns='episode_name'))
+    assert ([ast.literal_eval(x) for x in streamed_df.episode_name]
+            == [ast.literal_eval(x) for x in podcast_df.episode_name])
+
+
+def test_cached_spotify_reader(tmp_path, monkeypatch):
+    import hovercal.cache
+
+    with open('./endsong_data.json') as f:
+        records = json.load(f)
+    for i in range(3):
+        with open(tmp_path / f'endsong_{i}.json', 'w') as f:
+            json.dump(records[i::4], f)
+
+    files_read = []
+    read_spotify_file = hovercal.cache._read_spotify_file
+    def counting_read(file_name, podcast_name, tz=None):
+        files_read.append(os.path.basename(file_name))
+        return read_spotify_file(file_name, podcast_name, tz)
+    monkeypatch.setattr(hovercal.cache, '_read_spotify_file', counting_read)
+
+    glob_pattern = str(tmp_path / 'endsong_*.json')
+    cache_dir = str(tmp_path / 'cache')
+    podcast_name = 'The History of Egypt Podcast'
+
+    first_df = hovercal.cached_spotify_reader(glob_pattern, podcast_name, cache_dir=cache_dir)
+    assert first_df.equals(hovercal.spotify_reader(glob_pattern, podcast_name))
+    # Nothing new, nothing read
+    assert hovercal.cached_spotify_reader(glob_pattern, podcast_name, cache_dir=cache_dir).equals(first_df)
+    assert len(files_read) == 3
+
+    # A new export file is the only one parsed
+    with open(tmp_path / 'endsong_3.json', 'w') as f:
+        json.dump(records[3::4], f)
+    new_df = hovercal.cached_spotify_reader(glob_pattern, podcast_name, cache_dir=cache_dir)
+    assert files_read[3:] == ['endsong_3.json']
+    assert new_df.equals(hovercal.spotify_reader(glob_pattern, podcast_name))
+    # Only the latest merged frame is kept, and no temporary files are left behind
+    cache_files = os.listdir(cache_dir)
+    assert len([name for name in cache_files if name.startswith('daily_')]) == 1
+    assert not [name for name in cache_files if name.endswith('.tmp')]
+
+    # Files that change or go away don't leave their partials behind
+    for bump in range(3):
+        for i in range(4):
+            os.utime(tmp_path / f'endsong_{i}.json', ns=(10**18 + bump, 10**18 + bump))
+        hovercal.cached_spotify_reader(glob_pattern, podcast_name, cache_dir=cache_dir)
+    os.remove(tmp_path / 'endsong_3.json')
+    hovercal.cached_spotify_reader(glob_pattern, podcast_name, cache_dir=cache_dir)
+    cache_files = os.listdir(cache_dir)
+    assert len([name for name in cache_files if name.startswith('partial_')]) == 3
+    assert len([name for name in cache_files if name.startswith('daily_')]) == 1
+
+
+def test_calendar_geometry():
+    for year in [2020, 2021, 2022]:
+        grid_df = hovercal.calendar_grid(year)
+        # One cell per day, and no two days on the same cell
+        assert len(grid_df) == len(pd.date_range(f'1/1/{year}', f'12/31/{year}'))
+        assert not grid_df.duplicated(['weekcount', 'day_of_week']).any()
+        assert grid_df.weekcount.min() == 0
+        assert (grid_df.loc[grid_df.date.dt.weekday == 0, 'day_of_week'] == 6).all()
+
+        outlines, tick_locations = hovercal.month_outlines(year)
+        assert outlines.shape == (12, 8, 2)
+        assert (np.diff(tick_locations) > 0).all()
+
+    # Cached, but every call gets its own copy to change
+    grid_df = hovercal.calendar_grid(2021)
+    grid_df['weekcount'] = 0
+    assert hovercal.calendar_grid(2021).weekcount.max() > 0
+    assert hovercal.geometry._calendar_grid(2021) is hovercal.geometry._calendar_grid(2021)
+    assert hovercal.month_ticks(2021, 'Letter')[0][1] == 'J'
+
+
+def test_year_heatmap_compact():
+    from bokeh.models import GlyphRenderer, Plot
+
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+
+    glyph_counts = []
+    for year_list in [[2020], [2020, 2021, 2022]]:
+        pod_panel = hovercal.year_heatmap(correct_df,
+                                          year_list,
+                                          hover_columns = ['episode_name', 'unique_episodes'],
+                                          value_column = 'mPlayed',
+                                          compact = True)
+        glyph_counts.append(len(list(pod_panel.get_root().select({'type': GlyphRenderer}))))
+
+    # Adding years should not add glyphs
+    assert glyph_counts[0] == glyph_counts[1]
+
+    # The years are ticks in the middle of each year's rows, inside the plot range,
+    # and nothing is drawn left of the first week
+    plot = [plot for plot in pod_panel.get_root().select({'type': Plot}) if plot.select({'name': 'year_axis'})][0]
+    year_axis = list(plot.select({'name': 'year_axis'}))[0]
+    assert [year_axis.major_label_overrides[y] for y in year_axis.ticker.ticks] == ['2020', '2021', '2022']
+    assert all(plot.y_range.start < y < plot.y_range.end for y in year_axis.ticker.ticks)
+    assert -1 < plot.x_range.start < 0
+
+
+def test_year_heatmap_resolution():
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+    correct_df['date'] = pd.to_datetime(correct_df.date)
+
+    week_df = hovercal.period_totals(correct_df, 'week', value_column = 'mPlayed')
+    grid_df = pd.concat([hovercal.calendar_grid(year) for year in [2020, 2021, 2022]])
+    days_df = correct_df.merge(grid_df[['date', 'weekcount']], on='date')
+    correct = days_df.groupby([days_df.date.dt.year, 'weekcount']).mPlayed.sum()
+    assert np.allclose(week_df.mPlayed, correct.values)
+    assert week_df.days.sum() == len(correct_df)
+
+    month_df = hovercal.period_totals(correct_df, 'month', 'max', value_column = 'mPlayed')
+    assert np.allclose(month_df.mPlayed, correct_df.groupby(['year', 'month']).mPlayed.max().values)
+    assert (month_df.start.dt.day == 1).all()
+
+    pod_panel = hovercal.year_heatmap(correct_df,
+                                      [2020, 2021, 2022],
+                                      value_column = 'mPlayed',
+                                      resolution = 'month',
+                                      drill_down = True)
+    pod_panel.get_root()
+    # Picking a year draws its daily calendar
+    pod_panel[1].value = 2021
+    assert pod_panel[2]._pane is not None
+
+
+def test_color_range():
+    from bokeh.models import GlyphRenderer, Rect
+
+    values = np.array([0.5, 2.0, 4.0, 8.0, 1000.0, np.nan])
+    assert hovercal.color_range(values) == (1.0, 1000.0)
+    assert hovercal.color_range(values, 'log') == (0.5, 1000.0)
+    assert hovercal.color_range(values, clip_percentiles = (0, 75)) == (0.5, 8.0)
+    assert hovercal.color_range([np.nan]) == (1.0, 1.0)
+
+    # Ends of the range get the ends of the palette, the outlier is clipped to the top color
+    colors = hovercal.cell_colors(values, 0.5, 8.0, 'Blues', 'log', empty_color = 'gray')
+    assert colors[0] != colors[3]
+    assert colors[3] == colors[4]
+    assert colors[5] == 'gray'
+    assert hovercal.cell_colors([2.0], 0.5, 8.0, 'Blues', 'log')[0] == colors[1]
+
+    # Every year and the colorbar share the one range, with precomputed colors on the days
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+    pod_panel = hovercal.year_heatmap(correct_df,
+                                      [2020, 2021],
+                                      value_column = 'mPlayed',
+                                      clip_percentiles = (0, 90),
+                                      precomputed_colors = True)
+    cmap_range = hovercal.color_range(correct_df.loc[correct_df.year.isin([2020, 2021]), 'mPlayed'],
+                                      clip_percentiles = (0, 90))
+    rects = [r for r in pod_panel.get_root().select({'type': GlyphRenderer}) if isinstance(r.glyph, Rect)]
+    day_rects = [r for r in rects if 'cell_color' in r.data_source.data]
+    assert len(day_rects) == 2
+    assert all(r.glyph.fill_color.field == 'cell_color' for r in day_rects)
+    colorbar_mapper = [r for r in rects if r not in day_rects][0].glyph.fill_color.transform
+    assert (colorbar_mapper.low, colorbar_mapper.high) == cmap_range
+
+
+def test_year_heatmap_live():
+    from bokeh.models import GlyphRenderer, Plot, Rect
+
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+    live_cal = hovercal.year_heatmap(correct_df,
+                                     [2020, 2021],
+                                     hover_columns = ['episode_name'],
+                                     value_column = 'mPlayed',
+                                     live = True)
+    root = live_cal.layout.get_root()
+    sources = [r.data_source for r in root.select({'type': GlyphRenderer}) if isinstance(r.glyph, Rect)]
+
+    live_cal.update(pd.DataFrame({'date': ['2021-12-31'], 'year': [2021],
+                                  'mPlayed': [5000.0], 'episode_name': ["{'New Episode'}"]}))
+
+    # Same bokeh sources as before, now holding the new day, with the colorbar following
+    new_sources = [r.data_source for r in root.select({'type': GlyphRenderer}) if isinstance(r.glyph, Rect)]
+    assert [id(source) for source in sources] == [id(source) for source in new_sources]
+    assert max(np.nanmax(source.data['zvalues']) for source in new_sources) == 5000.0
+    assert live_cal.color_range.cmap_max == 5000.0
+
+    # A missing value clears the day, the other columns of the day are kept
+    live_cal.update(pd.DataFrame({'date': ['2021-12-31'], 'mPlayed': [np.nan]}))
+    day = live_cal.df.loc[pd.Timestamp('2021-12-31')]
+    assert np.isnan(day.mPlayed) and day.episode_name == "{'New Episode'}"
+    assert not any((np.asarray(source.data['zvalues']) == 5000.0).any() for source in new_sources)
+    assert live_cal.color_range.cmap_max < 5000.0
+
+    # Redrawn years keep the calendar styling, which holoviews would reset on the axes
+    live_cal.replace(correct_df.iloc[::2])
+    plots = [plot for plot in root.select({'type': Plot}) if plot.yaxis[0].axis_label in ('2020', '2021')]
+    assert len(plots) == 2
+    for plot in plots:
+        assert plot.yaxis[0].axis_label_text_font_size == '25pt'
+        assert plot.yaxis[0].major_label_text_font_size == '12pt'
+        assert plot.xaxis[0].axis_label_text_font_size == '0pt'
+        assert plot.xaxis[0].major_label_text_font_size == '12pt'
+
+
+def test_year_heatmap_live_patches():
+    from bokeh.document import Document
+    from bokeh.document.events import ColumnsPatchedEvent, ColumnDataChangedEvent
+
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+    for compact in [False, True]:
+        live_cal = hovercal.year_heatmap(correct_df,
+                                         [2020, 2021],
+                                         value_column = 'mPlayed',
+                                         live = True,
+                                         compact = compact)
+        doc = Document()
+        doc.add_root(live_cal.layout.get_root())
+        events = []
+        doc.on_change(events.append)
+
+        # Two days below the maximum only patch those two cells
+        live_cal.update(pd.DataFrame({'date': ['2021-12-30', '2021-12-31'], 'year': [2021, 2021],
+                                      'mPlayed': [5.0, 6.0]}))
+        patches = [event.patches for event in events if isinstance(event, ColumnsPatchedEvent)]
+        assert len(patches) == 1
+        assert all(len(cells) == 2 for cells in patches[0].values())
+        assert sorted(value for _, value in patches[0]['zvalues']) == [5.0, 6.0]
+        assert not any(isinstance(event, ColumnDataChangedEvent) for event in events)
+
+
+def test_crossfilter_calendar():
+    from bokeh.models import GlyphRenderer, Rect
+
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    cross_cal = hovercal.CrossFilterCalendar.from_spotify(spotify_df, 'episode_name', [2020, 2021])
+    root = cross_cal.layout.get_root()
+    sources = [r.data_source for r in root.select({'type': GlyphRenderer}) if isinstance(r.glyph, Rect)]
+
+    # Picking every episode adds back up to the podcast's daily totals
+    podcast_df = hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast')
+    podcast_df = podcast_df.loc[podcast_df.year.isin([2020, 2021])]
+    daily_df = cross_cal.daily_values(list(cross_cal.entities))
+    assert (daily_df.date.to_numpy() == podcast_df.date.to_numpy()).all()
+    assert np.allclose(daily_df.mPlayed, podcast_df.mPlayed)
+
+    # Picking in the widget swaps the data into the same bokeh sources
+    episode = cross_cal.entities[0]
+    cross_cal.picker.value = [episode]
+    new_sources = [r.data_source for r in root.select({'type': GlyphRenderer}) if isinstance(r.glyph, Rect)]
+    assert [id(source) for source in sources] == [id(source) for source in new_sources]
+    assert cross_cal.calendar.color_range.cmap_max == cross_cal.daily_values([episode]).mPlayed.max()
+    assert np.isclose(sum(np.nansum(source.data['zvalues']) for source in new_sources if 'date' in source.data),
+                      cross_cal.daily_values([episode]).mPlayed.sum())
+
+
+def test_small_multiples():
+    from bokeh.models import GlyphRenderer, Plot, Rect, Text
+
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+    # Pretend every third day was a different show
+    correct_df['show'] = np.array(['Egypt', 'Rome', 'Persia'])[np.arange(len(correct_df)) % 3]
+
+    renderer_counts = []
+    for entities in [['Egypt'], ['Egypt', 'Rome', 'Persia']]:
+        grid_panel = hovercal.small_multiples(correct_df, 'show', 2021, entities = entities,
+                                              n_columns = 2, value_column = 'mPlayed')
+        root = grid_panel.get_root()
+        renderers = list(root.select({'type': GlyphRenderer}))
+        renderer_counts.append(len(renderers))
+
+    # One heatmap for every calendar, holding every value of the year in its place
+    sources = [r.data_source for r in renderers if isinstance(r.glyph, Rect) and 'date' in r.data_source.data]
+    assert len(sources) == 1
+    data = sources[0].data
+    year_df = correct_df.loc[correct_df.year == 2021]
+    assert np.isclose(np.nansum(data['zvalues']), year_df.mPlayed.sum())
+    persia_df = year_df.loc[year_df.show == 'Persia']
+    cells = (np.asarray(data['show']) == 'Persia') & ~np.isnan(data['zvalues'])
+    assert set(pd.to_datetime(np.asarray(data['date'])[cells])) == set(pd.to_datetime(persia_df.date))
+    # More calendars are more cells, not more plot objects
+    assert renderer_counts[0] == renderer_counts[1]
+
+    # Every name hangs inside the plot range, above its own tile
+    plot = [plot for plot in root.select({'type': Plot}) if plot.select({'type': Text})][0]
+    labels = [r for r in plot.select({'type': GlyphRenderer}) if isinstance(r.glyph, Text)][0]
+    assert labels.glyph.text_baseline == 'top'
+    assert all(plot.x_range.start <= x < plot.x_range.end for x in labels.data_source.data['x'])
+    assert all(plot.y_range.start < y <= plot.y_range.end for y in labels.data_source.data['y'])
+    assert max(labels.data_source.data['y']) == plot.y_range.end
+
+
+def test_tile_cache(tmp_path):
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+    years = [2020, 2021, 2022]
+    tile_cache = hovercal.TileCache(str(tmp_path), max_memory_tiles = 2)
+
+    hovercal.year_heatmap(correct_df, years, value_column = 'mPlayed',
+                          cmap_range = (1, 300), tile_cache = tile_cache).get_root()
+    # Three years and the colorbar, only two kept in memory
+    assert tile_cache.stats == {'memory': 0, 'disk': 0, 'rendered': 4}
+    assert len(tile_cache) == 2
+
+    # New data in the last year only renders that year again
+    new_df = correct_df.copy()
+    new_df.loc[new_df.index[-1], 'mPlayed'] += 1
+    tiled_panel = hovercal.year_heatmap(new_df, years, value_column = 'mPlayed',
+                                        cmap_range = (1, 300), tile_cache = tile_cache)
+    assert tile_cache.stats['rendered'] == 5
+
+    # Another process finds the tiles on disk, and the layout still saves
+    disk_cache = hovercal.TileCache(str(tmp_path))
+    hovercal.year_heatmap(new_df, years, value_column = 'mPlayed',
+                          cmap_range = (1, 300), tile_cache = disk_cache)
+    assert disk_cache.stats == {'memory': 0, 'disk': 4, 'rendered': 0}
+    tiled_panel.save(str(tmp_path / 'tiled.html'))
+
+    # Every year tile is its own document, so hover lookups are made for each one
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    coded_df, episode_table = hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast',
+                                                       episode_codes = True)
+    for lookup_cache in [hovercal.TileCache(None), hovercal.TileCache(str(tmp_path / 'lookup'))]:
+        hovercal.year_heatmap(coded_df, years, value_column = 'mPlayed',
+                              hover_columns = ['episode_codes'],
+                              hover_lookup = {'episode_codes': episode_table},
+                              tile_cache = lookup_cache).get_root()
+        assert lookup_cache.stats['rendered'] == 4
+
+    # Options are keyed by value, objects whose repr can change aren't keyed at all
+    from hovercal.tiles import _tile_key
+    options = {'cmap_range': (np.float64(1), 300), 'hover_lookup': {'episode_name': ['a', 'b']}}
+    assert _tile_key('colorbar', None, options) == _tile_key('colorbar', None, dict(options))
+    assert _tile_key('colorbar', None, dict(options, cmap_color = object())) is None
+
+
+def test_fixed_cmap_range():
+    from bokeh.models import ColorMapper
+
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+
+    def mapper_ranges(root):
+        return {(mapper.low, mapper.high) for mapper in root.select({'type': ColorMapper})}
+
+    # A given range is used for every resolution, the drill down and live calendars
+    pod_panel = hovercal.year_heatmap(correct_df, [2020, 2021], value_column = 'mPlayed',
+                                      resolution = 'week', drill_down = True, cmap_range = (1, 300))
+    assert mapper_ranges(pod_panel.get_root()) == {(1, 300)}
+    pod_panel[1].value = 2021
+    assert mapper_ranges(pod_panel[2].get_root()) == {(1, 300)}
+
+    live_cal = hovercal.year_heatmap(correct_df, [2020, 2021], value_column = 'mPlayed',
+                                     live = True, cmap_range = (1, 300))
+    root = live_cal.layout.get_root()
+    live_cal.update(pd.DataFrame({'date': ['2021-12-31'], 'year': [2021], 'mPlayed': [5000.0]}))
+    assert mapper_ranges(root) == {(1, 300)}
+
+
+def test_batch_export(tmp_path):
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+
+    jobs = [(correct_df, [2020, 2021], {'value_column': 'mPlayed'}, str(tmp_path / 'ok.html')),
+            (correct_df, [2021], {'value_column': 'not_a_column'}, str(tmp_path / 'bad.html'))]
+    results = hovercal.batch_export(jobs, processes=2)
+
+    # The bad job is reported, and does not take the good one down with it
+    assert [result['path'] for result in results] == [job[-1] for job in jobs]
+    assert results[0]['error'] is None and results[0]['seconds'] > 0
+    assert (tmp_path / 'ok.html').exists()
+    assert results[1]['error'] is not None
+
+    # A job that kills its worker only fails itself, the jobs around it are redone
+    class KillWorker:
+        def __reduce__(self):
+            return (os._exit, (1,))
+
+    jobs = [(correct_df, [2020], {'value_column': 'mPlayed'}, str(tmp_path / f'ok_{i}.html')) for i in range(4)]
+    jobs.insert(1, (correct_df, [2021], {'value_column': KillWorker()}, str(tmp_path / 'crash.html')))
+    results = hovercal.batch_export(jobs, processes=2)
+    assert [result['path'] for result in results] == [job[-1] for job in jobs]
+    assert 'BrokenProcessPool' in results[1]['error']
+    for i, result in enumerate(results[:1] + results[2:]):
+        assert result['error'] is None
+        assert (tmp_path / f'ok_{i}.html').exists()
+
+
+def test_static_year_heatmap(tmp_path):
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+
+    svg = hovercal.static_year_heatmap(correct_df, [2020, 2021], value_column = 'mPlayed',
+                                       filename = str(tmp_path / 'cal.svg'))
+    assert svg.startswith('<svg') and svg.endswith('</svg>')
+    # A box for every day, colored or empty
+    assert svg.count('stroke="white"') == 366 + 365
+    assert svg.count('fill="#D3D3D3"') == 366 + 365 - len(correct_df.loc[correct_df.year.isin([2020, 2021])])
+
+    image = hovercal.static_year_heatmap(correct_df, [2020, 2021], value_column = 'mPlayed',
+                                         filename = str(tmp_path / 'cal.png'), scale = 2)
+    assert (tmp_path / 'cal.png').exists()
+    assert image.size[1] > 2 * 14 * 18
+
+
+def test_profile_stages():
+    spotify_df = pd.read_json('./endsong_data.json', lines=False)
+    correct_df = pd.read_csv('./podcast_df_correct.csv')
+
+    records = []
+    hovercal.register_callback(records.append)
+    try:
+        with hovercal.profile_stages(trace_memory=True) as profile:
+            hovercal.spotify_cleaner(spotify_df, 'The History of Egypt Podcast')
+            hovercal.year_heatmap(correct_df, [2020, 2021], value_column = 'mPlayed')
+    finally:
+        hovercal.unregister_callback(records.append)
+
+    totals = profile.as_dict()
+    for name in ['spotify_cleaner', 'single_year_heatmap', 'joint_colorbar', 'year_heatmap']:
+        assert totals[name]['seconds'] > 0
+        assert totals[name]['allocated_mb'] is not None
+    assert totals['single_year_heatmap']['calls'] == 2
+    assert len(profile.log_lines()) == len(totals)
+    assert records == profile.records
+
+    # Nothing is recorded once the block is over
+    hovercal.joint_colorbar(10, 100, 'Blues')
+    assert len(profile.records) == len(records)
+
+    # Profiles in concurrent threads only see their own stages
+    import threading
+    barrier = threading.Barrier(2)
+    profiles = {}
+    def run(name):
+        with hovercal.profile_stages() as thread_profile:
+            with hovercal.stage(name):
+                barrier.wait()
+                with hovercal.stage(f'{name}.inner'):
+                    barrier.wait()
+        profiles[name] = thread_profile
+    threads = [threading.Thread(target=run, args=(name,)) for name in ['a', 'b']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for name, thread_profile in profiles.items():
+        assert [(record['stage'], record['parent']) for record in thread_profile.records] == [(f'{name}.inner', name), (name, None)]
+
 
 def test_year_heatmap():
     correct_df = pd.read_csv('./podcast_df_correct.csv')